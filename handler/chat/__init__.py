@@ -1,5 +1,5 @@
 # pulled in so that other handlers can include them from here for conveience
-from simone.handlers import Registry, session
+from simone.handlers import Registry, outbound_executor, session
 
 from .advice import Advice
 from .echo import Echo
@@ -18,6 +18,7 @@ from .weather import Weather
 
 # Quell warnings
 Registry
+outbound_executor
 session
 Advice
 Coin
@@ -1,10 +1,159 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
+from glob import glob
 from dateutil.parser import ParserError, parse
+from django.conf import settings
+from logging import getLogger
+from os import makedirs, remove, replace, utime
+from os.path import basename, exists, getmtime, join
+from threading import Lock
 import holidays
+import json
 
 from simone.handlers import Registry
 
 
+class HolidayIndex(object):
+    '''
+    Index of date -> holidays around the world, built a year at a time.
+
+    Building a year means creating the holidays for every country so it's
+    done once per year, in executor, with concurrent requests for the same
+    year sharing the work. If path is set built years are written there and
+    read back rather than rebuilt by later processes.
+
+    At most max_years are held in memory, least recently used are dropped
+    first, and at most max_files are kept in path.
+    '''
+
+    log = getLogger('HolidayIndex')
+
+    def __init__(self, executor, path=None, max_years=5, max_files=20):
+        self.executor = executor
+        self.path = path
+        self.max_years = max_years
+        self.max_files = max_files
+
+        # year -> index, least recently used first
+        self._years = OrderedDict()
+        self._building = {}
+        self._lock = Lock()
+
+    def _filename(self, year):
+        # holidays changes between versions so don't share across them
+        return join(self.path, f'holidays-{holidays.__version__}-{year}.json')
+
+    def _load(self, year):
+        filename = self._filename(year)
+        if not exists(filename):
+            return None
+        try:
+            with open(filename) as fh:
+                index = json.load(fh)
+            # mark it as used so that pruning keeps it around
+            utime(filename)
+            return index
+        except (OSError, ValueError):
+            self.log.exception('_load: failed to read filename=%s', filename)
+            return None
+
+    def _save(self, year, index):
+        filename = self._filename(year)
+        try:
+            makedirs(self.path, exist_ok=True)
+            # write and then move into place so that readers never see a
+            # partial file
+            tmp = f'{filename}.tmp'
+            with open(tmp, 'w') as fh:
+                json.dump(index, fh)
+            replace(tmp, filename)
+        except OSError:
+            self.log.exception('_save: failed to write filename=%s', filename)
+        self._prune()
+
+    def _prune(self):
+        prefix = f'holidays-{holidays.__version__}-'
+        current = []
+        for filename in glob(join(self.path, 'holidays-*.json')):
+            try:
+                if basename(filename).startswith(prefix):
+                    current.append((getmtime(filename), filename))
+                else:
+                    # left behind by another version of holidays
+                    remove(filename)
+            except OSError:
+                pass
+        current.sort(reverse=True)
+        for _, filename in current[self.max_files :]:
+            try:
+                remove(filename)
+            except OSError:
+                pass
+
+    def _build(self, year):
+        try:
+            index = self._index(year)
+        except Exception:
+            with self._lock:
+                # let the next request try again
+                del self._building[year]
+            raise
+        with self._lock:
+            self._years[year] = index
+            while len(self._years) > self.max_years:
+                self._years.popitem(last=False)
+            del self._building[year]
+        return index
+
+    def _index(self, year):
+        index = self._load(year) if self.path else None
+        if index is None:
+            self.log.info('_index: year=%d', year)
+            index = {}
+            for name, *_ in sorted(holidays.registry.COUNTRIES.values()):
+                for day, holiday in getattr(holidays, name)(years=year).items():
+                    index.setdefault(day.isoformat(), []).append(
+                        f'{holiday} in {name}'
+                    )
+            if self.path:
+                self._save(year, index)
+        return index
+
+    def _submit(self, year):
+        # must be called with the lock held
+        try:
+            return self._building[year]
+        except KeyError:
+            future = self._building[year] = self.executor.submit(
+                self._build, year
+            )
+            return future
+
+    def warm(self, *years):
+        '''
+        Builds years in the background if they're not already available.
+        '''
+        with self._lock:
+            for year in years:
+                if year not in self._years:
+                    self._submit(year)
+
+    def get(self, day):
+        '''
+        Returns a list of the holidays on day.
+        '''
+        with self._lock:
+            index = self._years.get(day.year, None)
+            if index is None:
+                future = self._submit(day.year)
+            else:
+                self._years.move_to_end(day.year)
+        if index is None:
+            index = future.result()
+        return index.get(day.isoformat(), [])
+
+
 class Holidays(object):
     '''
     List out holidays around the world
@@ -16,26 +165,26 @@ class Holidays(object):
       .hollidays 2021-07-04
     '''
 
+    def __init__(self, index):
+        self.index = index
+
     def config(self):
         return {'commands': ('holidays',)}
 
     def command(self, context, text, **kwargs):
-        active = []
         if text:
             try:
-                today = parse(text)
+                today = parse(text).date()
             except ParserError:
                 context.say(f"Sorry. I'm unable to parse `{text}` into a date")
                 return
         else:
             today = date.today()
-        for cn in holidays.list_supported_countries():
-            if cn == cn.upper():
-                # this is an abbr
-                continue
-            holiday = getattr(holidays, cn)().get(today)
-            if holiday:
-                active.append(f'{holiday} in {cn}')
+        active = self.index.get(today)
+        if abs(today.year - date.today().year) <= 1:
+            # people tend to ask about dates around now next, far off ones
+            # are one-offs
+            self.index.warm(today.year - 1, today.year + 1)
 
         today = today.strftime('%Y-%m-%d')
         if active:
@@ -43,8 +192,20 @@ class Holidays(object):
             context.say(f'{today} is:\n```{active}```')
         else:
             context.say(
-                "{today} doesn't appear to be a holiday anywhere I have data for"
+                f"{today} doesn't appear to be a holiday anywhere I have data for"
             )
 
 
-Registry.register_handler(Holidays())
+Registry.register_handler(
+    Holidays(
+        HolidayIndex(
+            ThreadPoolExecutor(
+                max_workers=getattr(settings, 'HOLIDAYS_WARM_WORKERS', 2),
+                thread_name_prefix='simone-holidays',
+            ),
+            path=getattr(settings, 'HOLIDAYS_CACHE_DIR', None),
+            max_years=getattr(settings, 'HOLIDAYS_MAX_YEARS', 5),
+            max_files=getattr(settings, 'HOLIDAYS_MAX_FILES', 20),
+        )
+    )
+)
@@ -1,9 +1,13 @@
+from concurrent.futures import Future, wait
+from django.conf import settings
 from logging import getLogger
 from os import environ
-from random import sample
+from random import sample, shuffle
+from threading import Lock
 from time import time
 
-from simone.handlers import Registry, session
+from simone.handlers import Registry, outbound_executor, session
+from simone.scheduler import scheduler
 
 
 # register a token
@@ -68,6 +72,121 @@ _client = _Client(
 )
 
 
+class ImagePool(object):
+    '''
+    Search results for a fixed subject held in memory and refreshed every
+    interval seconds in the background.
+
+    Results are handed out in a random order without repeats until they've
+    all been used at which point they're shuffled and started over. Filling
+    begins when start is called, or the first take if that's sooner, and
+    nothing happens before that so there are no threads or requests at
+    import, e.g. before gunicorn has forked. Searches run on executor, the
+    scheduler only says when. Takes wait up to fill_timeout for the first
+    fill and never search themselves. While the pool is empty refreshes are
+    retried every retry_interval seconds.
+    '''
+
+    log = getLogger('ImagePool')
+
+    def __init__(
+        self,
+        subject,
+        search,
+        scheduler,
+        executor,
+        interval=3600,
+        retry_interval=60,
+        fill_timeout=5,
+    ):
+        self.subject = subject
+        self.search = search
+        self.scheduler = scheduler
+        self.executor = executor
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self.fill_timeout = fill_timeout
+
+        self._results = []
+        self._bag = []
+        self._lock = Lock()
+        # the first fill's future once started
+        self._filling = None
+
+    def refresh(self):
+        results = self.search(self.subject)
+        self.log.debug(
+            'refresh: subject=%s, results=%d', self.subject, len(results)
+        )
+        with self._lock:
+            self._results = results
+            self._bag = []
+
+    def _refresh(self):
+        # runs on executor, failures leave the current results in place until
+        # next time
+        try:
+            self.refresh()
+        except Exception:
+            self.log.exception('_refresh: failed, subject=%s', self.subject)
+        finally:
+            interval = self.interval if self._results else self.retry_interval
+            self.scheduler.schedule(interval, self._submit_refresh)
+
+    def _submit_refresh(self):
+        # runs on a scheduler thread, searches can be slow and shouldn't hold
+        # one of those up
+        self.executor.submit(self._refresh)
+
+    def start(self):
+        '''
+        Kicks off filling the pool if it hasn't been already and returns its
+        future.
+        '''
+        with self._lock:
+            start = self._filling is None
+            if start:
+                self._filling = Future()
+        if start:
+            # outside of the lock, refresh needs it
+            self.executor.submit(self._refresh).add_done_callback(
+                lambda _: self._filling.set_result(None)
+            )
+        return self._filling
+
+    def take(self, count):
+        '''
+        Returns up to count results, none if the pool couldn't be filled.
+        '''
+        filling = self._filling or self.start()
+        if not self._results:
+            # only waits on the first fill, and not for long
+            wait((filling,), timeout=self.fill_timeout)
+
+        ret = []
+        with self._lock:
+            count = min(count, len(self._results))
+            # results we already have in ret when the bag is refilled, they
+            # go back in for the next take
+            skipped = []
+            refilled = False
+            while len(ret) < count:
+                if not self._bag:
+                    if refilled:
+                        # been through everything, there are duplicates
+                        break
+                    refilled = True
+                    self._bag = list(self._results)
+                    shuffle(self._bag)
+                result = self._bag.pop()
+                if result in ret:
+                    skipped.append(result)
+                else:
+                    ret.append(result)
+            self._bag.extend(skipped)
+        return ret
+
+
 class Images(object):
     '''
     Images of a subject of your choice
@@ -84,11 +203,29 @@ class Images(object):
     def config(self):
         return {'commands': ('image', 'image bomb')}
 
+    def _count(self, command):
+        return 5 if 'bomb' in command else 1
+
+    def _converse(self, context, sampled):
+        context.converse([f'<{s["url"]}|{s["title"]}>' for s in sampled])
+
+    def start(self, **kwargs):
+        # pooled subjects are filled before anyone asks
+        self.pool.start()
+
+    def _converse_pool(self, context, command):
+        taken = self.pool.take(self._count(command))
+        if not taken:
+            context.say(
+                f"I'm still rounding up {self.pool.subject} pictures, try again in a minute"
+            )
+            return
+        self._converse(context, taken)
+
     def command(self, context, command, text, **kwargs):
         results = _client.image_search(text)
-        count = 5 if 'bomb' in command else 1
-        sampled = sample(results, min(count, len(results)))
-        context.converse([f'<{s["url"]}|{s["title"]}>' for s in sampled])
+        count = self._count(command)
+        self._converse(context, sample(results, min(count, len(results))))
 
 
 Registry.register_handler(Images())
@@ -105,14 +242,29 @@ class Kittens(Images):
       .kitten bomb
     '''
 
-    def config(self):
-        return {'commands': ('kitten', 'kitten bomb')}
-
-    def command(self, context, text, **kwargs):
-        super().command(context, text='kitten', **kwargs)
-
+    def __init__(self, pool):
+        self.pool = pool
 
-Registry.register_handler(Kittens())
+    def config(self):
+        return {'commands': ('kitten', 'kitten bomb'), 'start': True}
+
+    def command(self, context, command, **kwargs):
+        self._converse_pool(context, command)
+
+
+Registry.register_handler(
+    Kittens(
+        ImagePool(
+            'kitten',
+            _client.image_search,
+            scheduler,
+            outbound_executor,
+            interval=getattr(settings, 'IMAGE_POOL_INTERVAL', 3600),
+            retry_interval=getattr(settings, 'IMAGE_POOL_RETRY_INTERVAL', 60),
+            fill_timeout=getattr(settings, 'IMAGE_POOL_FILL_TIMEOUT', 5),
+        )
+    )
+)
 
 
 class Puppies(Images):
@@ -126,11 +278,26 @@ class Puppies(Images):
       .puppy bomb
     '''
 
-    def config(self):
-        return {'commands': ('puppy', 'puppy bomb')}
-
-    def command(self, context, text, **kwargs):
-        super().command(context, text='puppy', **kwargs)
-
+    def __init__(self, pool):
+        self.pool = pool
 
-Registry.register_handler(Puppies())
+    def config(self):
+        return {'commands': ('puppy', 'puppy bomb'), 'start': True}
+
+    def command(self, context, command, **kwargs):
+        self._converse_pool(context, command)
+
+
+Registry.register_handler(
+    Puppies(
+        ImagePool(
+            'puppy',
+            _client.image_search,
+            scheduler,
+            outbound_executor,
+            interval=getattr(settings, 'IMAGE_POOL_INTERVAL', 3600),
+            retry_interval=getattr(settings, 'IMAGE_POOL_RETRY_INTERVAL', 60),
+            fill_timeout=getattr(settings, 'IMAGE_POOL_FILL_TIMEOUT', 5),
+        )
+    )
+)
@@ -1,8 +1,28 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
 from logging import getLogger
 from os import environ
+from threading import Lock
+from time import monotonic, time
 
-from simone.handlers import Registry, session
+from handler.models import StonksNamespace
+from simone.handlers import Registry, outbound_executor, session
+from simone.metrics import metrics
+
+metrics.describe(
+    'simone_stonks_quote_cache_total',
+    'counter',
+    'Quote cache lookups by result, hit, miss, or coalesced',
+)
+metrics.describe(
+    'simone_stonks_namespace_memo_total',
+    'counter',
+    'WSJ namespace memo lookups by result, hit, negative, or miss',
+)
 
 
 def emojify_number(value):
@@ -37,6 +57,191 @@ def round_to_cents(value):
     return int(100 * value) / 100.0
 
 
+class QuoteCache(object):
+    '''
+    Caches quotes by symbol for ttl seconds, negative_ttl for ones that
+    weren't found so that a glitch doesn't hide a symbol for long.
+
+    Concurrent misses for the same symbol are coalesced so that only the
+    first does the fetch and the rest wait for and share its result.
+    Failures aren't cached, everyone waiting on them sees the exception.
+    '''
+
+    log = getLogger('QuoteCache')
+
+    def __init__(self, ttl=30, negative_ttl=5):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        self._entries = {}
+        self._in_flight = {}
+        self._lock = Lock()
+
+    def _count(self, result):
+        metrics.inc('simone_stonks_quote_cache_total', (('result', result),))
+
+    def get_many(self, symbols, fetch_many):
+        '''
+        Returns a dict of symbol -> value. fetch_many is called at most once,
+        with the symbols that aren't cached or already being fetched, and
+        must return a dict with a value for each of them.
+        '''
+        ret = {}
+        waiting = {}
+        mine = {}
+        now = time()
+        with self._lock:
+            for symbol in symbols:
+                if symbol in ret or symbol in waiting or symbol in mine:
+                    continue
+                try:
+                    value, expires = self._entries[symbol]
+                    if expires > now:
+                        self._count('hit')
+                        ret[symbol] = value
+                        continue
+                    del self._entries[symbol]
+                except KeyError:
+                    pass
+                try:
+                    waiting[symbol] = self._in_flight[symbol]
+                    self._count('coalesced')
+                except KeyError:
+                    mine[symbol] = self._in_flight[symbol] = Future()
+                    self._count('miss')
+
+        if mine:
+            try:
+                fetched = fetch_many(list(mine.keys()))
+            except Exception as e:
+                with self._lock:
+                    for symbol in mine:
+                        del self._in_flight[symbol]
+                for future in mine.values():
+                    future.set_exception(e)
+                raise
+            now = time()
+            with self._lock:
+                for symbol in mine:
+                    value = fetched[symbol]
+                    ttl = (
+                        self.ttl if value[0] is not None else self.negative_ttl
+                    )
+                    self._entries[symbol] = (value, now + ttl)
+                    del self._in_flight[symbol]
+            for symbol, future in mine.items():
+                future.set_result(fetched[symbol])
+                ret[symbol] = fetched[symbol]
+
+        for symbol, future in waiting.items():
+            ret[symbol] = future.result()
+
+        return ret
+
+    def get(self, symbol, fetch):
+        return self.get_many(
+            (symbol,), lambda symbols: {symbol: fetch(symbol)}
+        )[symbol]
+
+
+class NamespaceMemo(object):
+    '''
+    Remembers which WSJ namespace symbols were found in so that they can be
+    requested directly rather than searching all of them.
+
+    Backed by StonksNamespace with an in-memory front. Symbols WSJ doesn't
+    know about are remembered as a blank namespace for negative_ttl seconds
+    after which they'll be searched for again.
+    '''
+
+    log = getLogger('NamespaceMemo')
+
+    def __init__(self, negative_ttl=86400):
+        self.negative_ttl = negative_ttl
+
+        # symbol -> (namespace, expires), expires is None for positives
+        self._entries = {}
+        self._lock = Lock()
+
+    def _count(self, result, n=1):
+        if n:
+            metrics.inc(
+                'simone_stonks_namespace_memo_total', (('result', result),), n
+            )
+
+    def get(self, symbols):
+        '''
+        Returns a dict of symbol -> namespace for the symbols we know about,
+        namespace will be blank when WSJ doesn't have it.
+        '''
+        ret = {}
+        now = time()
+        with self._lock:
+            for symbol in symbols:
+                try:
+                    namespace, expires = self._entries[symbol]
+                except KeyError:
+                    continue
+                if expires is None or expires > now:
+                    ret[symbol] = namespace
+        missing = [s for s in symbols if s not in ret]
+        if missing:
+            cutoff = timezone.now() - timedelta(seconds=self.negative_ttl)
+            found = StonksNamespace.objects.filter(symbol__in=missing)
+            with self._lock:
+                for row in found:
+                    expires = None
+                    if not row.namespace:
+                        if row.updated_at < cutoff:
+                            # expired, time to look again
+                            continue
+                        expires = (
+                            now + (row.updated_at - cutoff).total_seconds()
+                        )
+                    self._entries[row.symbol] = (row.namespace, expires)
+                    ret[row.symbol] = row.namespace
+
+        negative = sum(1 for namespace in ret.values() if not namespace)
+        self._count('hit', len(ret) - negative)
+        self._count('negative', negative)
+        self._count('miss', len(symbols) - len(ret))
+        return ret
+
+    def learn(self, found, not_found, forget):
+        '''
+        found is a dict of symbol -> namespace, not_found a list of symbols
+        that aren't in any namespace, and forget a list of symbols whose
+        namespace no longer works.
+        '''
+        self.log.debug(
+            'learn: found=%s, not_found=%s, forget=%s', found, not_found, forget
+        )
+        expires = time() + self.negative_ttl
+        objs = []
+        with self._lock:
+            for symbol, namespace in found.items():
+                self._entries[symbol] = (namespace, None)
+                objs.append(StonksNamespace(symbol=symbol, namespace=namespace))
+            for symbol in not_found:
+                self._entries[symbol] = ('', expires)
+                objs.append(StonksNamespace(symbol=symbol, namespace=''))
+            for symbol in forget:
+                self._entries.pop(symbol, None)
+        if forget:
+            StonksNamespace.objects.filter(symbol__in=forget).delete()
+        if objs:
+            # MySQL upserts on any unique key and doesn't accept a target
+            unique_fields = None
+            if connection.features.supports_update_conflicts_with_target:
+                unique_fields = ('symbol',)
+            StonksNamespace.objects.bulk_create(
+                objs,
+                update_conflicts=True,
+                unique_fields=unique_fields,
+                update_fields=('namespace', 'updated_at'),
+            )
+
+
 # TODO: explore https://finnhub.io/register
 class Stonks(object):
     '''
@@ -45,6 +250,7 @@ class Stonks(object):
     To get stonk quotes:
       .stonks tsla
       .stonks btc
+      .stonks tsla aapl btc
 
     To get stock quotes:
       .stocks tsla
@@ -81,31 +287,62 @@ class Stonks(object):
     }
 
     def __init__(
-        self, alpha_vantage_key, wsj_quotes_ckey, wsj_quotes_entitlement_token
+        self,
+        alpha_vantage_key,
+        wsj_quotes_ckey,
+        wsj_quotes_entitlement_token,
+        cache,
+        namespaces,
+        executor=outbound_executor,
+        wsj_timeout=15,
+        alpha_vantage_timeout=5,
+        hedge_delay=2,
+        max_hedged=3,
     ):
         self.alpha_vantage_key = alpha_vantage_key
         self.wsj_quotes_ckey = wsj_quotes_ckey
         self.wsj_quotes_entitlement_token = wsj_quotes_entitlement_token
-
-        self._executor = ThreadPoolExecutor()
+        self.cache = cache
+        self.namespaces = namespaces
+        self.executor = executor
+        self.wsj_timeout = wsj_timeout
+        self.alpha_vantage_timeout = alpha_vantage_timeout
+        self.hedge_delay = hedge_delay
+        self.max_hedged = max_hedged
 
     def config(self):
         return {'commands': ('stocks', 'stonks')}
 
-    def lookup_wsj(self, text):
+    def _memoable(self, symbol):
+        return (
+            '/' not in symbol
+            and symbol not in self.WSJ_ALIASES
+            and len(symbol)
+            <= StonksNamespace._meta.get_field('symbol').max_length
+        )
+
+    def _wsj_ids(self, text, namespace=None):
         text = text.replace('-', '.')
         if '/' in text:
             # try an exact match
-            id_param = text
-        else:
-            try:
-                id_param = self.WSJ_ALIASES[text]
-                self.log.debug('alias id_param=%s', id_param)
-            except KeyError:
-                namespaced = [f'{tok}/{text}' for tok in self.WSJ_NAMESPACES]
-                id_param = ','.join(namespaced)
-                self.log.debug('namespaced id_param=%s', id_param)
+            return [text]
+        try:
+            return [self.WSJ_ALIASES[text]]
+        except KeyError:
+            pass
+        if namespace:
+            # we've found it before
+            return [f'{namespace}/{text}']
+        return [f'{tok}/{text}' for tok in self.WSJ_NAMESPACES]
 
+    def lookup_wsj(self, ids):
+        '''
+        Looks up all of ids with a single request. Returns a dict of id ->
+        (open_value, last_value, change) for the ones that were found, id ->
+        None for the ones WSJ answered without a match, or None if the
+        request failed. Ids WSJ didn't answer for are left out.
+        '''
+        self.log.debug('lookup_wsj: ids=%s', ids)
         resp = session.get(
             self.WSJ_URL,
             params={
@@ -114,25 +351,38 @@ class Stonks(object):
                 'accept': 'application/json',
                 'ckey': self.wsj_quotes_ckey,
                 'dialect': 'charting',
-                'id': id_param,
+                'id': ','.join(ids),
                 'needed': 'CompositeTrading',
             },
-            timeout=15,
+            timeout=self.wsj_timeout,
         )
         if resp.status_code != 200:
-            return (None, None, None)
+            return None
         data = resp.json()
-        for ir in data.get('InstrumentResponses', []):
+        ret = {}
+        responses = data.get('InstrumentResponses', None) or []
+        # responses come back in the order they were requested, but WSJ may
+        # leave some out so position can only stand in for a missing
+        # RequestId when there's one for every id
+        positional = len(responses) == len(ids)
+        for i, ir in enumerate(responses):
             try:
+                id_ = ir.get('RequestId', None)
+                if id_ is None:
+                    if not positional:
+                        continue
+                    id_ = ids[i]
+                if not ir['Matches']:
+                    ret[id_] = None
+                    continue
                 ct = ir['Matches'][0]['CompositeTrading']
                 open_value = round_to_cents(ct['Open']['Value'])
                 last_value = round_to_cents(ct['Last']['Price']['Value'])
                 change = round_to_cents(ct['NetChange']['Value'])
-                return (open_value, last_value, change)
-            except (IndexError, KeyError):
+                ret[id_] = (open_value, last_value, change)
+            except (AttributeError, IndexError, KeyError, TypeError):
                 pass
-
-        return (None, None, None)
+        return ret
 
     def lookup_crypto(self, text):
         url = 'https://www.alphavantage.co/query'
@@ -142,7 +392,9 @@ class Stonks(object):
             'market': 'USD',
             'apikey': self.alpha_vantage_key,
         }
-        resp = session.get(url, params=params)
+        resp = session.get(
+            url, params=params, timeout=self.alpha_vantage_timeout
+        )
         if resp.status_code != 200:
             self.log.error(
                 'lookup_crypto: request failed, code=%d, content=%s',
@@ -155,31 +407,165 @@ class Stonks(object):
         if error:
             self.log.debug('lookup_crypto: error=%s', error)
             return (None, None, None)
-        data = data['Time Series (Digital Currency Daily)']
-        dates = data.keys()
-        dates = sorted(dates, reverse=True)
-        # most recent
-        latest = data[dates[0]]
-        open_value = float(latest['1. open'])
-        last_value = float(latest['4. close'])
+        try:
+            data = data['Time Series (Digital Currency Daily)']
+            dates = data.keys()
+            dates = sorted(dates, reverse=True)
+            # most recent
+            latest = data[dates[0]]
+            open_value = float(latest['1. open'])
+            last_value = float(latest['4. close'])
+        except (IndexError, KeyError, TypeError, ValueError):
+            # rate limiting comes back as a 200 with a Note or Information
+            # rather than the time series
+            self.log.warning(
+                'lookup_crypto: unexpected response, text=%s, data=%s',
+                text,
+                data,
+            )
+            return (None, None, None)
         return (open_value, last_value, last_value - open_value)
 
-    def lookup(self, text):
-        wsj = self._executor.submit(self.lookup_wsj, text)
-        crypto = self._executor.submit(self.lookup_crypto, text)
-        for future in as_completed((wsj, crypto)):
-            open_value, last_value, change = future.result()
-            if open_value is not None:
-                return (open_value, last_value, change)
-        # nobody had an answer
-        return (None, None, None)
-
-    def stonks(self, context, text, open_value, last_value, change, change_pct):
-        if open_value is None:
-            context.say(
-                f"I couldn't find the price for `{text}` so I'll just go ahead and assume it's NOT STONKS :not_stonks:"
+    def _wsj_found(self, ids, quotes, ret):
+        # fills in ret with anything WSJ found that we don't already have and
+        # returns symbol -> namespace for the ones it found along with the
+        # symbols it said it had no match for under any of their ids
+        found = {}
+        asked = Counter()
+        unmatched = Counter()
+        # earlier namespaces win
+        for id_, id_symbols in ids.items():
+            asked.update(id_symbols)
+            if id_ not in quotes:
+                continue
+            if quotes[id_] is None:
+                unmatched.update(id_symbols)
+                continue
+            for symbol in id_symbols:
+                if symbol not in found:
+                    found[symbol] = id_.rsplit('/', 1)[0]
+                    if ret[symbol][0] is None:
+                        ret[symbol] = quotes[id_]
+        not_found = [s for s, n in unmatched.items() if n == asked[s]]
+        return found, not_found
+
+    def lookup(self, symbols):
+        '''
+        Asks WSJ about everything with a single request and then Alpha
+        Vantage about whatever it didn't know. If WSJ hasn't answered within
+        hedge_delay Alpha Vantage is asked in the meantime about up to
+        max_hedged of the symbols WSJ isn't known to have, its quota is
+        tight. The first valid quote for each symbol wins and whatever's
+        outstanding once we have them all is abandoned.
+        '''
+        ret = {symbol: (None, None, None) for symbol in symbols}
+
+        memoable = [s for s in symbols if self._memoable(s)]
+        known = self.namespaces.get(memoable)
+        # id -> symbols, aliases mean more than one symbol can share an id
+        ids = {}
+        for symbol in symbols:
+            namespace = known.get(symbol, None)
+            if namespace == '':
+                # WSJ doesn't have it, no point in asking
+                continue
+            for id_ in self._wsj_ids(symbol, namespace):
+                ids.setdefault(id_, []).append(symbol)
+        # aliases are WSJ specific
+        hedgeable = [s for s in symbols if s not in self.WSJ_ALIASES]
+
+        # future -> symbol, None for WSJ
+        futures = {}
+        asked = set()
+
+        def ask_alpha_vantage(hedging=False):
+            pending = [
+                s for s in hedgeable if ret[s][0] is None and s not in asked
+            ]
+            if hedging:
+                # WSJ will answer for the ones it has
+                pending = [s for s in pending if not known.get(s, None)]
+                pending = pending[: self.max_hedged]
+            for symbol in pending:
+                asked.add(symbol)
+                future = self.executor.submit(self.lookup_crypto, symbol)
+                futures[future] = symbol
+
+        if ids:
+            futures[self.executor.submit(self.lookup_wsj, list(ids))] = None
+        else:
+            ask_alpha_vantage()
+        deadline = (
+            monotonic()
+            + self.hedge_delay
+            + max(self.wsj_timeout, self.alpha_vantage_timeout)
+        )
+        hedged = not ids
+        found = None
+        not_found = None
+
+        while futures and any(quote[0] is None for quote in ret.values()):
+            if hedged:
+                timeout = max(deadline - monotonic(), 0)
+            else:
+                timeout = self.hedge_delay
+            done, _ = wait(
+                futures, timeout=timeout, return_when=FIRST_COMPLETED
             )
-            return
+            if not done:
+                if hedged:
+                    self.log.warning('lookup: timed out, symbols=%s', symbols)
+                    break
+                self.log.debug('lookup: hedging')
+                ask_alpha_vantage(hedging=True)
+                hedged = True
+                continue
+            for future in done:
+                symbol = futures.pop(future)
+                try:
+                    quote = future.result()
+                except Exception:
+                    self.log.exception('lookup: failed, symbol=%s', symbol)
+                    quote = None
+                if symbol is not None:
+                    # Alpha Vantage
+                    if (
+                        quote
+                        and quote[0] is not None
+                        and ret[symbol][0] is None
+                    ):
+                        ret[symbol] = quote
+                    continue
+                # WSJ, and then Alpha Vantage for anything it didn't find
+                if quote:
+                    found, not_found = self._wsj_found(ids, quote, ret)
+                ask_alpha_vantage()
+                hedged = True
+
+        for future in futures:
+            # abandon the losers, anything that's started will finish and be
+            # ignored
+            future.cancel()
+
+        # only what WSJ actually answered is learned from, a response without
+        # any instruments tells us nothing
+        if found is not None:
+            self.namespaces.learn(
+                {
+                    s: found[s]
+                    for s in memoable
+                    if s in found and s not in known
+                },
+                [s for s in memoable if s in not_found and s not in known],
+                # what we remembered didn't work, start over next time
+                [s for s in memoable if s in not_found and known.get(s, None)],
+            )
+
+        return ret
+
+    def stonks(self, text, open_value, last_value, change, change_pct):
+        if open_value is None:
+            return f"I couldn't find the price for `{text}` so I'll just go ahead and assume it's NOT STONKS :not_stonks:"
         response = f'`{text}` is '
         if change > 0:
             response += ' STONKS :stonks:'
@@ -195,38 +581,33 @@ class Stonks(object):
             + emojify_number(plus_or_minus(change_pct) + '%')
             + ')'
         )
-        context.say(response)
+        return response
 
-    def stocks(self, context, text, open_value, last_value, change, change_pct):
+    def stocks(self, text, open_value, last_value, change, change_pct):
         if open_value is None:
-            context.say(f"I couldn't find the price for `{text}`")
-            return
-        context.say(
-            f'`{text}`: {last_value} ({plus_or_minus(change)}) ({plus_or_minus(change_pct)}%)'
-        )
+            return f"I couldn't find the price for `{text}`"
+        return f'`{text}`: {last_value} ({plus_or_minus(change)}) ({plus_or_minus(change_pct)}%)'
 
     def command(self, context, command, text, **kwargs):
-        text = text.upper()
-        if text in self.WSJ_ALIASES:
-            # special case go straight to WSJ
-            self.log.debug('command: wsj specific')
-            open_value, last_value, change = self.lookup_wsj(text)
-        else:
-            self.log.debug('command: trying all')
-            open_value, last_value, change = self.lookup(text)
-
-        # TODO: handle unknown/None values
-
-        change_pct = round(100 * (change / open_value), 2)
+        symbols = text.upper().replace(',', ' ').split()
+        if not symbols:
+            context.say(
+                f'What would you like me to look up, see `.help {command}`'
+            )
+            return
+        quotes = self.cache.get_many(symbols, self.lookup)
 
-        if command == 'stonks':
-            self.stonks(
-                context, text, open_value, last_value, change, change_pct
+        render = self.stonks if command == 'stonks' else self.stocks
+        responses = []
+        for symbol in symbols:
+            open_value, last_value, change = quotes[symbol]
+            change_pct = (
+                round(100 * (change / open_value), 2) if open_value else 0
             )
-        else:
-            self.stocks(
-                context, text, open_value, last_value, change, change_pct
+            responses.append(
+                render(symbol, open_value, last_value, change, change_pct)
             )
+        context.say('\n'.join(responses))
 
 
 alpha_vantage_key = environ['ALPHA_VANTAGE_KEY']
@@ -234,5 +615,24 @@ wsj_quotes_ckey = environ['WSJ_QUOTES_CKEY']
 wsj_quotes_entitlement_token = environ['WSJ_QUOTES_ENTITLEMENT_TOKEN']
 
 Registry.register_handler(
-    Stonks(alpha_vantage_key, wsj_quotes_ckey, wsj_quotes_entitlement_token)
+    Stonks(
+        alpha_vantage_key,
+        wsj_quotes_ckey,
+        wsj_quotes_entitlement_token,
+        QuoteCache(
+            ttl=getattr(settings, 'STONKS_QUOTE_TTL', 30),
+            negative_ttl=getattr(settings, 'STONKS_QUOTE_NEGATIVE_TTL', 5),
+        ),
+        NamespaceMemo(
+            negative_ttl=getattr(
+                settings, 'STONKS_NAMESPACE_NEGATIVE_TTL', 86400
+            )
+        ),
+        wsj_timeout=getattr(settings, 'STONKS_WSJ_TIMEOUT', 15),
+        alpha_vantage_timeout=getattr(
+            settings, 'STONKS_ALPHA_VANTAGE_TIMEOUT', 5
+        ),
+        hedge_delay=getattr(settings, 'STONKS_HEDGE_DELAY', 2),
+        max_hedged=getattr(settings, 'STONKS_MAX_HEDGED', 3),
+    )
 )
@@ -0,0 +1,114 @@
+from django.core.management.base import BaseCommand
+from random import Random
+from timeit import timeit
+
+from simone.commands import CommandTrie
+from simone.dispatcher import Dispatcher
+
+
+class Command(BaseCommand):
+    '''
+    Micro-benchmark comparing the command trie against the previous
+    tuple-prefix probing with a synthetic set of registered commands.
+    '''
+
+    name = 'bench_router'
+    help = 'Benchmark command routing'
+
+    WORDS = (
+        'add',
+        'bomb',
+        'forget',
+        'image',
+        'is',
+        'joke',
+        'list',
+        'me',
+        'not',
+        'quote',
+        'rem',
+        'show',
+        'tell',
+        'who',
+        Dispatcher.USER_PLACEHOLDER,
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--commands', type=int, default=300)
+        parser.add_argument('--number', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def _commands(self, rand, n):
+        commands = set()
+        while len(commands) < n:
+            length = rand.randint(1, 3)
+            words = [f'{rand.choice(self.WORDS)}{len(commands)}']
+            words += [rand.choice(self.WORDS) for _ in range(length - 1)]
+            commands.add(tuple(words))
+        return sorted(commands)
+
+    def _probe(self, command_words, command_max_words, text):
+        # the pre-trie implementation of Dispatcher.find_command_handler
+        pieces = text.strip().split()
+        processed_pieces = []
+        for piece in pieces:
+            if piece.startswith('<@'):
+                piece = Dispatcher.USER_PLACEHOLDER
+            elif piece.startswith('<#'):
+                piece = Dispatcher.CHANNEL_PLACEHOLDER
+            processed_pieces.append(piece)
+        n = min(len(processed_pieces), command_max_words)
+        candidates = [tuple(processed_pieces[0:i]) for i in range(n, 0, -1)]
+        for candidate in candidates:
+            try:
+                return command_words[candidate], len(candidate)
+            except KeyError:
+                pass
+        return None, 0
+
+    def handle(self, *args, **options):
+        rand = Random(options['seed'])
+        commands = self._commands(rand, options['commands'])
+
+        command_words = {}
+        command_max_words = 0
+        trie = CommandTrie(
+            Dispatcher.USER_PLACEHOLDER, Dispatcher.CHANNEL_PLACEHOLDER
+        )
+        for i, command in enumerate(commands):
+            command_words[command] = i
+            command_max_words = max(command_max_words, len(command))
+            trie.add(command, i)
+
+        texts = []
+        for command in rand.sample(commands, min(50, len(commands))):
+            words = [
+                '<@U01V6PW6XDE>' if w == Dispatcher.USER_PLACEHOLDER else w
+                for w in command
+            ]
+            texts.append(' '.join(words + ['some', 'trailing', 'text']))
+        texts += ['nothing matches this one at all', 'huh?']
+
+        for text in texts:
+            expected = self._probe(command_words, command_max_words, text)
+            if expected != trie.match(text.strip().split()):
+                raise Exception(f'mismatch for text={text}')
+
+        number = options['number']
+
+        def probe():
+            for text in texts:
+                self._probe(command_words, command_max_words, text)
+
+        def match():
+            for text in texts:
+                trie.match(text.strip().split())
+
+        lookups = number * len(texts)
+        for name, func in (('probe', probe), ('trie', match)):
+            elapsed = timeit(func, number=number)
+            self.stdout.write(
+                f'{name:>6}: commands={len(commands)}, '
+                f'max_words={command_max_words}, lookups={lookups}, '
+                f'per_lookup={1000000 * elapsed / lookups:.3f}us'
+            )
@@ -0,0 +1,78 @@
+from django.core.management.base import BaseCommand
+from math import ceil
+from pylev import levenshtein
+from random import Random
+from time import time
+
+from simone.commands import BKTree
+
+
+class Command(BaseCommand):
+    '''
+    Benchmark comparing the cost per unknown command of "did you mean"
+    suggestions using the BK-tree index against full pairwise Levenshtein.
+    '''
+
+    name = 'bench_suggestions'
+    help = 'Benchmark did you mean suggestions'
+
+    LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', nargs='+', type=int, default=[50, 500, 5000]
+        )
+        parser.add_argument('--misses', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def _word(self, rand):
+        return ''.join(
+            rand.choice(self.LETTERS) for _ in range(rand.randint(3, 10))
+        )
+
+    def _typo(self, rand, word):
+        i = rand.randrange(len(word))
+        return word[:i] + rand.choice(self.LETTERS) + word[i + 1 :]
+
+    def _pairwise(self, names, candidate, cutoff):
+        # the pre-index implementation of Dispatcher._did_you_mean
+        scored = sorted((levenshtein(candidate, n), n) for n in names)
+        return set(n for s, n in scored if s < cutoff)
+
+    def handle(self, *args, **options):
+        rand = Random(options['seed'])
+        for size in options['sizes']:
+            names = set()
+            while len(names) < size:
+                names.add(self._word(rand))
+            names = sorted(names)
+
+            start = time()
+            index = BKTree(levenshtein, names)
+            build = time() - start
+
+            misses = [
+                self._typo(rand, rand.choice(names))
+                for _ in range(options['misses'])
+            ]
+
+            results = {}
+            for name, func in (
+                ('pairwise', lambda m, c: self._pairwise(names, m, c)),
+                (
+                    'bktree',
+                    lambda m, c: set(
+                        n for _, n in index.search(m, ceil(c) - 1)
+                    ),
+                ),
+            ):
+                start = time()
+                results[name] = [func(m, len(m) * 0.5) for m in misses]
+                elapsed = time() - start
+                self.stdout.write(
+                    f'{name:>9}: commands={size}, misses={len(misses)}, '
+                    f'per_miss={1000 * elapsed / len(misses):.3f}ms'
+                )
+            if results['pairwise'] != results['bktree']:
+                raise Exception(f'mismatched suggestions, commands={size}')
+            self.stdout.write(f'{"":>9}  bktree build={1000 * build:.3f}ms')
@@ -0,0 +1,34 @@
+from django.db import models
+
+
+class Generation(models.Model):
+    '''
+    Shared version stamps for per-process handler caches. A process that
+    changes the data behind a cache bumps its generation and the others
+    notice the next time they check.
+    '''
+
+    name = models.CharField(max_length=64, unique=True)
+    generation = models.BigIntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.name} - {self.generation}'
+
+
+class StonksNamespace(models.Model):
+    '''
+    The WSJ namespace a stonks symbol was found in. A blank namespace means
+    WSJ didn't know about the symbol as of updated_at.
+    '''
+
+    symbol = models.CharField(max_length=32, unique=True)
+    namespace = models.CharField(max_length=64, blank=True)
+
+    updated_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.symbol} - {self.namespace}'
@@ -0,0 +1,521 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, timedelta
+from django.test import TestCase
+from django.utils import timezone
+from mock import MagicMock, patch
+from os import listdir
+from os.path import join
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+
+from .chat.holidays import HolidayIndex
+from .chat.images import ImagePool
+from .chat.stonks import NamespaceMemo, QuoteCache, Stonks
+from .models import StonksNamespace
+
+
+class TestHolidayIndex(TestCase):
+    def test_index(self):
+        with TemporaryDirectory() as path:
+            index = HolidayIndex(ThreadPoolExecutor(max_workers=2), path=path)
+            index.warm(2021)
+            holidays = index.get(date(2021, 12, 25))
+            self.assertIn('Christmas Day in UnitedStates', holidays)
+            # built once and then just lookups
+            with patch.object(index, '_index') as index_mock:
+                self.assertEqual(holidays, index.get(date(2021, 12, 25)))
+                self.assertIn(
+                    'Independence Day in UnitedStates',
+                    index.get(date(2021, 7, 4)),
+                )
+                index_mock.assert_not_called()
+            self.assertEqual(1, len(listdir(path)))
+
+            # another process can pick up where we left off from disk
+            other = HolidayIndex(ThreadPoolExecutor(max_workers=1), path=path)
+            with patch('handler.chat.holidays.holidays.registry') as registry:
+                self.assertEqual(holidays, other.get(date(2021, 12, 25)))
+                registry.COUNTRIES.values.assert_not_called()
+
+    def test_failure(self):
+        index = HolidayIndex(ThreadPoolExecutor(max_workers=1))
+        with patch.object(index, '_index', side_effect=Exception('boom')):
+            with self.assertRaises(Exception):
+                index.get(date(2021, 12, 25))
+        # we'll try again next time
+        self.assertTrue(index.get(date(2021, 12, 25)))
+
+    def test_bounded(self):
+        with TemporaryDirectory() as path:
+            index = HolidayIndex(
+                ThreadPoolExecutor(max_workers=1),
+                path=path,
+                max_years=2,
+                max_files=2,
+            )
+            open(join(path, 'holidays-0.0-2021.json'), 'w').close()
+            with patch.object(index, '_index', return_value={}) as index_mock:
+                index.get(date(2021, 1, 1))
+                index.get(date(2022, 1, 1))
+                # 2021 is used again so 2022 is the one dropped
+                index.get(date(2021, 1, 1))
+                index.get(date(2023, 1, 1))
+                self.assertEqual([2021, 2023], sorted(index._years))
+                self.assertEqual(3, index_mock.call_count)
+            for year in range(2020, 2024):
+                index._save(year, {})
+            # only the newest max_files of this version are kept
+            self.assertEqual(2, len(listdir(path)))
+            self.assertNotIn('holidays-0.0-2021.json', listdir(path))
+
+
+class TestQuoteCache(TestCase):
+    @patch('handler.chat.stonks.time')
+    def test_ttl(self, time_mock):
+        time_mock.return_value = 100
+        cache = QuoteCache(ttl=10)
+        calls = []
+
+        def fetch(symbol):
+            calls.append(symbol)
+            return (1, 2, 1)
+
+        self.assertEqual((1, 2, 1), cache.get('TSLA', fetch))
+        time_mock.return_value = 109
+        self.assertEqual((1, 2, 1), cache.get('TSLA', fetch))
+        self.assertEqual(['TSLA'], calls)
+        time_mock.return_value = 110
+        cache.get('TSLA', fetch)
+        cache.get('AAPL', fetch)
+        self.assertEqual(['TSLA', 'TSLA', 'AAPL'], calls)
+
+    @patch('handler.chat.stonks.time')
+    def test_negative_ttl(self, time_mock):
+        time_mock.return_value = 100
+        cache = QuoteCache(ttl=10, negative_ttl=2)
+        calls = []
+
+        def fetch(symbol):
+            calls.append(symbol)
+            return (None, None, None)
+
+        cache.get('NOPE', fetch)
+        time_mock.return_value = 101
+        cache.get('NOPE', fetch)
+        self.assertEqual(['NOPE'], calls)
+        # not found is only remembered briefly
+        time_mock.return_value = 102
+        cache.get('NOPE', fetch)
+        self.assertEqual(['NOPE', 'NOPE'], calls)
+
+    def test_coalescing(self):
+        cache = QuoteCache()
+        started = Event()
+        release = Event()
+        calls = []
+
+        def fetch(symbol):
+            calls.append(symbol)
+            started.set()
+            release.wait()
+            return (1, 2, 1)
+
+        results = []
+        leader = Thread(target=lambda: results.append(cache.get('TSLA', fetch)))
+        leader.start()
+        started.wait()
+        follower = Thread(
+            target=lambda: results.append(cache.get('TSLA', fetch))
+        )
+        # the follower has to be waiting on the leader's fetch before it's
+        # allowed to finish
+        coalesced = Event()
+        count = cache._count
+
+        def _count(result):
+            count(result)
+            if result == 'coalesced':
+                coalesced.set()
+
+        with patch.object(cache, '_count', _count):
+            follower.start()
+            self.assertTrue(coalesced.wait(5))
+        release.set()
+        leader.join()
+        follower.join()
+        self.assertEqual(['TSLA'], calls)
+        self.assertEqual([(1, 2, 1), (1, 2, 1)], results)
+
+    def test_failure(self):
+        cache = QuoteCache()
+
+        def fetch(symbol):
+            raise Exception('boom')
+
+        with self.assertRaises(Exception):
+            cache.get('TSLA', fetch)
+        # not cached
+        self.assertEqual((1, 2, 1), cache.get('TSLA', lambda s: (1, 2, 1)))
+
+
+def _wsj_match(open_value, last_value, change):
+    return {
+        'Matches': [
+            {
+                'CompositeTrading': {
+                    'Open': {'Value': open_value},
+                    'Last': {'Price': {'Value': last_value}},
+                    'NetChange': {'Value': change},
+                }
+            }
+        ]
+    }
+
+
+class TestStonks(TestCase):
+    @patch('handler.chat.stonks.session')
+    def test_batch(self, session_mock):
+        stonks = Stonks('key', 'ckey', 'token', QuoteCache(), NamespaceMemo())
+        # TSLA is found in the second namespace, BTC is an alias, and nothing
+        # knows about NOPE
+        wsj = MagicMock()
+        wsj.status_code = 200
+        wsj.json.return_value = {
+            'InstrumentResponses': [
+                {'RequestId': 'STOCK/US/XNAS/TSLA', 'Matches': []},
+                dict(
+                    RequestId='STOCK/US/XNYS/TSLA', **_wsj_match(100, 110, 10)
+                ),
+                dict(
+                    RequestId='CRYPTOCURRENCY/US/CoinDesk/BTCUSD',
+                    **_wsj_match(200, 190, -10),
+                ),
+            ]
+            + [
+                {'RequestId': f'{namespace}/NOPE', 'Matches': []}
+                for namespace in Stonks.WSJ_NAMESPACES
+            ]
+        }
+        alpha_vantage = MagicMock()
+        alpha_vantage.status_code = 200
+        alpha_vantage.json.return_value = {'Error Message': 'nope'}
+        session_mock.get.side_effect = lambda url, **kwargs: (
+            wsj if url == Stonks.WSJ_URL else alpha_vantage
+        )
+
+        context = MagicMock()
+        stonks.command(context, command='stocks', text='tsla btc, nope')
+        context.say.assert_called_once_with(
+            '`TSLA`: 110.0 (+10.0) (+10.0%)\n'
+            '`BTC`: 190.0 (-10.0) (-5.0%)\n'
+            "I couldn't find the price for `NOPE`"
+        )
+
+        # a single request to WSJ for everything, Alpha Vantage only for
+        # the leftover
+        self.assertEqual(2, session_mock.get.call_count)
+        ids = session_mock.get.call_args_list[0][1]['params']['id'].split(',')
+        self.assertEqual(21, len(ids))
+        self.assertIn('CRYPTOCURRENCY/US/CoinDesk/BTCUSD', ids)
+        self.assertEqual(
+            'NOPE', session_mock.get.call_args_list[1][1]['params']['symbol']
+        )
+
+        # and now they're all cached
+        session_mock.reset_mock()
+        context.reset_mock()
+        stonks.command(context, command='stocks', text='TSLA')
+        context.say.assert_called_once_with('`TSLA`: 110.0 (+10.0) (+10.0%)')
+        session_mock.get.assert_not_called()
+
+        # where things were found, or not, is remembered
+        self.assertEqual(
+            [('NOPE', ''), ('TSLA', 'STOCK/US/XNYS')],
+            list(
+                StonksNamespace.objects.order_by('symbol').values_list(
+                    'symbol', 'namespace'
+                )
+            ),
+        )
+        # so a new process will go straight to the right instrument and not
+        # bother WSJ with NOPE
+        stonks = Stonks('key', 'ckey', 'token', QuoteCache(), NamespaceMemo())
+        wsj.json.return_value = {
+            'InstrumentResponses': [
+                dict(RequestId='STOCK/US/XNYS/TSLA', **_wsj_match(100, 110, 10))
+            ]
+        }
+        stonks.command(context, command='stocks', text='TSLA NOPE')
+        self.assertEqual(
+            'STOCK/US/XNYS/TSLA',
+            session_mock.get.call_args_list[0][1]['params']['id'],
+        )
+        self.assertEqual(
+            'NOPE', session_mock.get.call_args_list[1][1]['params']['symbol']
+        )
+
+    @patch('handler.chat.stonks.session')
+    def test_learning(self, session_mock):
+        StonksNamespace.objects.create(symbol='GONE', namespace='STOCK/US/XNAS')
+        stonks = Stonks('key', 'ckey', 'token', QuoteCache(), NamespaceMemo())
+        wsj = MagicMock()
+        wsj.status_code = 200
+        session_mock.get.return_value = wsj
+
+        # a response without any instruments tells us nothing
+        wsj.json.return_value = {}
+        stonks.lookup(['GONE', 'NOPE'])
+        self.assertEqual(
+            [('GONE', 'STOCK/US/XNAS')],
+            list(StonksNamespace.objects.values_list('symbol', 'namespace')),
+        )
+
+        # only ids WSJ said it had no match for count against a symbol, NOPE
+        # wasn't answered for in every namespace so we'll ask again
+        wsj.json.return_value = {
+            'InstrumentResponses': [
+                {'RequestId': 'STOCK/US/XNAS/GONE', 'Matches': []},
+                {'RequestId': 'STOCK/US/XNAS/NOPE', 'Matches': []},
+            ]
+        }
+        stonks.lookup(['GONE', 'NOPE'])
+        self.assertFalse(StonksNamespace.objects.exists())
+
+    @patch('handler.chat.stonks.session')
+    def test_shared_ids(self, session_mock):
+        stonks = Stonks('key', 'ckey', 'token', QuoteCache(), NamespaceMemo())
+        wsj = MagicMock()
+        wsj.status_code = 200
+        wsj.json.return_value = {
+            'InstrumentResponses': [
+                dict(
+                    RequestId='CRYPTOCURRENCY/US/CoinDesk/BTCUSD',
+                    **_wsj_match(200, 190, -10),
+                )
+            ]
+        }
+        session_mock.get.return_value = wsj
+        # both aliases are the same instrument, asked about once and
+        # answered for each
+        self.assertEqual(
+            {'BTC': (200, 190, -10), 'BITCOIN': (200, 190, -10)},
+            stonks.lookup(['BTC', 'BITCOIN']),
+        )
+        self.assertEqual(
+            'CRYPTOCURRENCY/US/CoinDesk/BTCUSD',
+            session_mock.get.call_args[1]['params']['id'],
+        )
+
+    @patch('handler.chat.stonks.session')
+    def test_wsj_request_ids(self, session_mock):
+        stonks = Stonks('key', 'ckey', 'token', QuoteCache(), NamespaceMemo())
+        wsj = MagicMock()
+        wsj.status_code = 200
+        session_mock.get.return_value = wsj
+
+        # without RequestIds position is used when there's a response for
+        # every id
+        wsj.json.return_value = {
+            'InstrumentResponses': [_wsj_match(1, 2, 1), {'Matches': []}]
+        }
+        self.assertEqual(
+            {'A': (1, 2, 1), 'B': None}, stonks.lookup_wsj(['A', 'B'])
+        )
+        # and ignored otherwise since we can't know which they're for
+        wsj.json.return_value = {
+            'InstrumentResponses': [
+                _wsj_match(1, 2, 1),
+                dict(RequestId='C', **_wsj_match(3, 4, 1)),
+            ]
+        }
+        self.assertEqual({'C': (3, 4, 1)}, stonks.lookup_wsj(['A', 'B', 'C']))
+
+    @patch('handler.chat.stonks.session')
+    def test_crypto_rate_limited(self, session_mock):
+        stonks = Stonks('key', 'ckey', 'token', QuoteCache(), NamespaceMemo())
+        resp = MagicMock()
+        resp.status_code = 200
+        resp.json.return_value = {'Note': 'Thank you for using Alpha Vantage!'}
+        session_mock.get.return_value = resp
+        self.assertEqual((None, None, None), stonks.lookup_crypto('DOGE'))
+
+    def test_hedging(self):
+        release = Event()
+        stonks = Stonks(
+            'key',
+            'ckey',
+            'token',
+            QuoteCache(),
+            NamespaceMemo(),
+            executor=ThreadPoolExecutor(max_workers=4),
+            hedge_delay=0.01,
+        )
+        calls = []
+
+        def lookup_wsj(ids):
+            calls.append('wsj')
+            release.wait()
+            return {}
+
+        def lookup_crypto(symbol):
+            calls.append(symbol)
+            return (1, 2, 1) if symbol == 'DOGE' else (None, None, None)
+
+        with patch.object(stonks, 'lookup_wsj', lookup_wsj), patch.object(
+            stonks, 'lookup_crypto', lookup_crypto
+        ):
+            # WSJ is stuck so once hedge_delay has passed Alpha Vantage is
+            # asked about everything it could know, DOGE comes back and we
+            # don't wait for WSJ
+            self.assertEqual({'DOGE': (1, 2, 1)}, stonks.lookup(['DOGE']))
+            # nothing has an answer for TSLA so we have to wait on WSJ
+            release.set()
+            self.assertEqual(
+                {'TSLA': (None, None, None), 'BTC': (None, None, None)},
+                stonks.lookup(['TSLA', 'BTC']),
+            )
+        # BTC is a WSJ alias so Alpha Vantage is never asked about it
+        self.assertEqual(['DOGE', 'TSLA', 'wsj', 'wsj'], sorted(calls))
+        # WSJ never answered for DOGE so nothing was learned about it
+        self.assertFalse(StonksNamespace.objects.filter(symbol='DOGE').exists())
+
+    def test_hedging_quota(self):
+        release = Event()
+        stonks = Stonks(
+            'key',
+            'ckey',
+            'token',
+            QuoteCache(),
+            NamespaceMemo(),
+            executor=ThreadPoolExecutor(max_workers=4),
+            hedge_delay=0.01,
+            max_hedged=2,
+        )
+        StonksNamespace.objects.create(symbol='TSLA', namespace='STOCK/US/XNAS')
+        hedged = []
+
+        def lookup_wsj(ids):
+            release.wait()
+            return {}
+
+        def lookup_crypto(symbol):
+            hedged.append(symbol)
+            if len(hedged) == 2:
+                release.set()
+            return (None, None, None)
+
+        with patch.object(stonks, 'lookup_wsj', lookup_wsj), patch.object(
+            stonks, 'lookup_crypto', lookup_crypto
+        ):
+            stonks.lookup(['TSLA', 'A', 'B', 'C'])
+        # WSJ is known to have TSLA so it isn't hedged and only max_hedged of
+        # the rest are until WSJ answers, then Alpha Vantage gets the leftovers
+        self.assertEqual(['A', 'B'], sorted(hedged[:2]))
+        self.assertEqual(['A', 'B', 'C', 'TSLA'], sorted(hedged))
+
+
+class TestNamespaceMemo(TestCase):
+    def test_memo(self):
+        memo = NamespaceMemo(negative_ttl=60)
+        self.assertEqual({}, memo.get(['TSLA', 'NOPE', 'GONE']))
+        memo.learn(
+            {'TSLA': 'STOCK/US/XNAS', 'GONE': 'STOCK/US/XNYS'}, ['NOPE'], []
+        )
+
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                {'TSLA': 'STOCK/US/XNAS', 'NOPE': ''},
+                memo.get(['TSLA', 'NOPE']),
+            )
+
+        memo.learn({}, [], ['GONE'])
+        self.assertEqual({}, NamespaceMemo().get(['GONE']))
+
+        # negatives expire
+        StonksNamespace.objects.filter(symbol='NOPE').update(
+            updated_at=timezone.now() - timedelta(seconds=61)
+        )
+        other = NamespaceMemo(negative_ttl=60)
+        self.assertEqual({'TSLA': 'STOCK/US/XNAS'}, other.get(['TSLA', 'NOPE']))
+
+
+class _InlineExecutor(object):
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, func, *args):
+        self.submitted.append(func)
+        future = Future()
+        future.set_result(func(*args))
+        return future
+
+
+class TestImagePool(TestCase):
+    def test_pool(self):
+        search = MagicMock(return_value=[])
+        scheduler = MagicMock()
+        executor = _InlineExecutor()
+        pool = ImagePool(
+            'kitten', search, scheduler, executor, interval=42, retry_interval=7
+        )
+
+        # filling happens on executor once started, an empty search is
+        # retried sooner
+        pool.start()
+        pool.start()
+        search.assert_called_once_with('kitten')
+        self.assertEqual([pool._refresh], executor.submitted)
+        scheduler.schedule.assert_called_once_with(7, pool._submit_refresh)
+        # takes don't search themselves
+        self.assertEqual([], pool.take(4))
+        search.assert_called_once()
+
+        # the scheduler hands refreshes off to executor and once there are
+        # results refreshing is at interval
+        scheduler.reset_mock()
+        search.return_value = list(range(10))
+        pool._submit_refresh()
+        self.assertEqual(2, len(executor.submitted))
+        scheduler.schedule.assert_called_once_with(42, pool._submit_refresh)
+
+        # no repeats until everything has been handed out, and then we start
+        # over
+        taken = pool.take(4) + pool.take(1) + pool.take(5)
+        self.assertEqual(list(range(10)), sorted(taken))
+        self.assertEqual(3, len(set(pool.take(3))))
+        # never more than there are and never the same one twice in a take
+        self.assertEqual(list(range(10)), sorted(pool.take(20)))
+        # a take spanning a refill gets everything it skipped next time
+        pool._bag = [8, 9]
+        with patch('handler.chat.images.shuffle'):
+            self.assertEqual([9, 8, 7, 6], pool.take(4))
+        self.assertEqual([0, 1, 2, 3, 4, 5, 9, 8], pool._bag)
+        self.assertEqual(2, search.call_count)
+
+        # failures keep the old results and it's still scheduled again
+        scheduler.reset_mock()
+        search.side_effect = Exception('boom')
+        pool._refresh()
+        self.assertEqual(10, len(pool.take(10)))
+        scheduler.schedule.assert_called_once_with(42, pool._submit_refresh)
+
+    def test_first_take(self):
+        release = Event()
+
+        def search(subject):
+            release.wait()
+            return ['first']
+
+        pool = ImagePool(
+            'kitten',
+            search,
+            MagicMock(),
+            ThreadPoolExecutor(max_workers=1),
+            fill_timeout=0.01,
+        )
+        # the first take starts the fill and gives up waiting on it after
+        # fill_timeout
+        self.assertEqual([], pool.take(1))
+        release.set()
+        pool.start().result()
+        self.assertEqual(['first'], pool.take(1))
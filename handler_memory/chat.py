@@ -1,6 +1,8 @@
+from django.conf import settings
 from io import StringIO
 
-from simone.handlers import Registry, only_public
+from simone.handlers import Registry, generations, only_public
+from .cache import LRUCache
 from .models import Item
 
 
@@ -18,9 +20,35 @@ class Memory(object):
         .forget <the thing>
     '''
 
+    GENERATION = 'memory'
+
+    def __init__(self, cache):
+        self.cache = cache
+
     def config(self):
         return {'commands': ('rem', 'remember', 'forget')}
 
+    def _recall(self, key):
+        if generations.stale(self.GENERATION):
+            # another worker has remembered or forgotten something
+            self.cache.clear()
+        item = self.cache.get(key)
+        if item is LRUCache.MISSING:
+            try:
+                item = Item.objects.get(key=key)
+            except Item.DoesNotExist:
+                item = None
+            self.cache.put(key, item)
+        return item
+
+    def _invalidate(self, key, item):
+        # depending on the collation keys may match case-insensitively so
+        # there can be other entries for the same item, writes are rare
+        # enough to just start over
+        self.cache.clear()
+        self.cache.put(key, item)
+        generations.bump(self.GENERATION)
+
     @only_public
     def command(self, context, command, text, **kwargs):
         if command in ('rem', 'remember'):
@@ -32,9 +60,7 @@ class Memory(object):
                 # search
                 text = text.split('|', 1)[1].strip()
                 max_items = 25
-                items = Item.objects.filter(key__icontains=text)[
-                    : max_items + 1
-                ]
+                items = Item.search(text, max_items + 1)
                 if items:
                     buf = StringIO()
                     buf.write('You might be looking for one of these:\n```')
@@ -52,29 +78,41 @@ class Memory(object):
             elif ' is ' in text:
                 # we're recording
                 key, value = text.split(' is ', 1)
-                try:
-                    item = Item.objects.get(key=key)
+                # writes go by what's in the database, the cache may be
+                # behind another worker's
+                item = Item.objects.filter(key=key).first()
+                if item:
                     context.say(
                         f"Unfortunately, {item.key} is already stored as {item.value}; Try forgetting it first"
                     )
-                except Item.DoesNotExist:
+                else:
                     item = Item.objects.create(key=key, value=value)
+                    self._invalidate(key, item)
                     context.say(f"OK. I'll remember {item.key} is {item.value}")
             else:
-                try:
-                    item = Item.objects.get(key=text)
+                item = self._recall(text)
+                if item:
                     context.say(f'{item.key} is {item.value}')
-                except Item.DoesNotExist:
+                else:
                     context.say(
                         f"Sorry. I don't remember anything about {text}"
                     )
         else:  # forget
-            try:
-                item = Item.objects.get(key=text)
+            item = Item.objects.filter(key=text).first()
+            if item:
                 context.say(f"OK. I'll forget that {item.key} was {item.value}")
                 item.delete()
-            except Item.DoesNotExist:
+                self._invalidate(text, None)
+            else:
                 context.say(f"Sorry. I don't remember anything about {text}")
 
 
-Registry.register_handler(Memory())
+Registry.register_handler(
+    Memory(
+        LRUCache(
+            maxsize=getattr(settings, 'MEMORY_CACHE_SIZE', 1000),
+            ttl=getattr(settings, 'MEMORY_CACHE_TTL', 300),
+            negative_ttl=getattr(settings, 'MEMORY_CACHE_NEGATIVE_TTL', 10),
+        )
+    )
+)
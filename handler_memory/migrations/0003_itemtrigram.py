@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:37
+
+from django.db import migrations, models
+from unicodedata import combining, normalize
+import django.db.models.deletion
+
+
+def trigrams(s):
+    # a copy of handler_memory.models.trigrams as of this migration
+    s = ''.join(c for c in normalize('NFKD', s.casefold()) if not combining(c))
+    return set(s[i : i + 3] for i in range(len(s) - 2))
+
+
+def index_items(apps, schema_editor):
+    # the historical models don't have Item.save's indexing so we do it here
+    Item = apps.get_model('handler_memory', 'Item')
+    ItemTrigram = apps.get_model('handler_memory', 'ItemTrigram')
+    for item in Item.objects.only('id', 'key').iterator():
+        ItemTrigram.objects.bulk_create(
+            [ItemTrigram(item=item, trigram=t) for t in trigrams(item.key)]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [('handler_memory', '0002_auto_20211021_1536')]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemTrigram',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                ('trigram', models.CharField(db_index=True, max_length=3)),
+                (
+                    'item',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='trigrams',
+                        to='handler_memory.item',
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(index_items, migrations.RunPython.noop),
+    ]
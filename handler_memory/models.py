@@ -1,4 +1,17 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count
+from django.db.models.functions import Length
+from unicodedata import combining, normalize
+
+
+def trigrams(s):
+    '''
+    The set of three character substrings of s, case and accent folded.
+    MySQL's default collations consider those equal so folding them here
+    keeps what we store and what we search for in agreement.
+    '''
+    s = ''.join(c for c in normalize('NFKD', s.casefold()) if not combining(c))
+    return set(s[i : i + 3] for i in range(len(s) - 2))
 
 
 class Item(models.Model):
@@ -8,5 +21,68 @@ class Item(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember what's been indexed so that saves can tell if the key
+        # changed
+        instance._indexed_key = instance.__dict__.get('key', None)
+        return instance
+
+    def save(self, *args, **kwargs):
+        reindex = self._state.adding or self.key != getattr(
+            self, '_indexed_key', None
+        )
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if reindex:
+                # keep the search index in step with the key
+                self.trigrams.all().delete()
+                ItemTrigram.objects.bulk_create(
+                    [
+                        ItemTrigram(item=self, trigram=t)
+                        for t in trigrams(self.key)
+                    ]
+                )
+                self._indexed_key = self.key
+
+    @classmethod
+    def search(cls, text, limit):
+        '''
+        Items whose keys contain text, shortest, i.e. closest, first.
+        Anything containing text has all of its trigrams so the index narrows
+        things down to those candidates before the substring check.
+        '''
+        items = cls.objects.filter(key__icontains=text)
+        grams = trigrams(text)
+        if grams:
+            candidates = (
+                ItemTrigram.objects.filter(trigram__in=grams)
+                .values('item')
+                .annotate(score=Count('id'))
+                .filter(score=len(grams))
+                .values('item')
+            )
+            items = items.filter(id__in=candidates)
+        # otherwise it's too short to have any trigrams, fall back to a scan
+        return list(items.order_by(Length('key'), 'key')[:limit])
+
     def __str__(self):
         return f'{self.key} - {self.value}'
+
+
+class ItemTrigram(models.Model):
+    '''
+    Search index of Item keys, each row is one of the trigrams of an item's
+    key. Rows are removed along with their item.
+    '''
+
+    item = models.ForeignKey(
+        Item, on_delete=models.CASCADE, related_name='trigrams'
+    )
+    # trigrams() de-dupes, a unique constraint would be at the mercy of the
+    # column's collation
+    trigram = models.CharField(max_length=3, db_index=True)
+
+    def __str__(self):
+        return f'{self.item_id} - {self.trigram}'
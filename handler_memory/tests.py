@@ -0,0 +1,162 @@
+from django.test import TestCase
+from mock import MagicMock, patch
+from time import time
+
+from simone.context import ChannelType
+from simone.handlers import _Generations
+from .cache import LRUCache
+from .chat import Memory
+from .models import Item, ItemTrigram, trigrams
+
+
+class TestLRUCache(TestCase):
+    def test_lru(self):
+        cache = LRUCache(maxsize=2)
+        self.assertIs(LRUCache.MISSING, cache.get('a'))
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        # b is now the least recently used
+        cache.put('c', 3)
+        self.assertIs(LRUCache.MISSING, cache.get('b'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+        self.assertEqual((3, 2), (cache.hits, cache.misses))
+
+    @patch('handler_memory.cache.time')
+    def test_ttl(self, time_mock):
+        time_mock.return_value = 100
+        cache = LRUCache(ttl=10, negative_ttl=1)
+        cache.put('a', 1)
+        cache.put('b', None)
+        time_mock.return_value = 101
+        self.assertEqual(1, cache.get('a'))
+        self.assertIs(LRUCache.MISSING, cache.get('b'))
+        time_mock.return_value = 110
+        self.assertIs(LRUCache.MISSING, cache.get('a'))
+        self.assertEqual(0, len(cache))
+
+
+class TestMemory(TestCase):
+    def setUp(self):
+        # each test starts without any knowledge of generations
+        patcher = patch(
+            'handler_memory.chat.generations', _Generations(interval=30)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.memory = Memory(LRUCache())
+        self.context = MagicMock()
+        self.context.channel_type = ChannelType.PUBLIC
+
+    def command(self, command, text):
+        self.context.reset_mock()
+        self.memory.command(
+            self.context, command=command, text=text, dispatcher=None
+        )
+        return self.context.say.call_args[0][0]
+
+    def test_recall(self):
+        Item.objects.create(key='thing', value='stuff')
+        # a generation check and the lookups
+        with self.assertNumQueries(3):
+            self.assertEqual('thing is stuff', self.command('rem', 'thing'))
+            self.assertIn("don't remember", self.command('rem', 'nothing'))
+        # both the hit and the miss are cached
+        with self.assertNumQueries(0):
+            self.assertEqual('thing is stuff', self.command('rem', 'thing'))
+            self.assertIn("don't remember", self.command('rem', 'nothing'))
+
+    def test_write_through(self):
+        self.assertIn("don't remember", self.command('rem', 'thing'))
+        self.assertIn("I'll remember", self.command('rem', 'thing is stuff'))
+        with self.assertNumQueries(0):
+            self.assertEqual('thing is stuff', self.command('rem', 'thing'))
+        # writes check the database
+        with self.assertNumQueries(1):
+            self.assertIn('already stored', self.command('rem', 'thing is x'))
+
+        self.assertIn("I'll forget", self.command('forget', 'thing'))
+        self.assertFalse(Item.objects.exists())
+        with self.assertNumQueries(0):
+            self.assertIn("don't remember", self.command('rem', 'thing'))
+
+    def test_other_worker(self):
+        Item.objects.create(key='thing', value='stuff')
+        self.assertEqual('thing is stuff', self.command('rem', 'thing'))
+
+        Item.objects.all().delete()
+        _Generations(interval=0).bump(Memory.GENERATION)
+        # still cached until we next check the generation
+        self.assertEqual('thing is stuff', self.command('rem', 'thing'))
+        with patch('simone.handlers.time', return_value=time() + 31):
+            self.assertIn("don't remember", self.command('rem', 'thing'))
+
+    def test_write_stale_cache(self):
+        self.assertIn("don't remember", self.command('rem', 'thing'))
+        # another worker remembers it, our cached miss doesn't know yet
+        Item.objects.create(key='thing', value='stuff')
+        self.assertIn("don't remember", self.command('rem', 'thing'))
+        # but writes don't go by the cache
+        self.assertIn('already stored', self.command('rem', 'thing is x'))
+        self.assertIn("I'll forget", self.command('forget', 'thing'))
+        self.assertFalse(Item.objects.exists())
+
+
+class TestSearch(TestCase):
+    def test_trigrams(self):
+        self.assertEqual(set(), trigrams('ab'))
+        self.assertEqual({'abc'}, trigrams('AbC'))
+        self.assertEqual({'abc', 'bca', 'cab'}, trigrams('abcabc'))
+        # case and accents are folded so these are the same
+        self.assertEqual(
+            {'caf', 'afe', 'fe ', 'e c', ' ca'}, trigrams('cafe CAFÉ')
+        )
+
+    def test_index(self):
+        item = Item.objects.create(key='Hello', value='world')
+        self.assertEqual(
+            {'hel', 'ell', 'llo'},
+            set(item.trigrams.values_list('trigram', flat=True)),
+        )
+
+        item.key = 'help'
+        item.save()
+        self.assertEqual(
+            {'hel', 'elp'}, set(item.trigrams.values_list('trigram', flat=True))
+        )
+
+        # the index is only rebuilt when the key changes
+        item = Item.objects.get(id=item.id)
+        item.value = 'me'
+        # the update and its savepoint
+        with self.assertNumQueries(3):
+            item.save()
+
+        item.delete()
+        self.assertFalse(ItemTrigram.objects.exists())
+
+    def test_search(self):
+        for key in ('the office', 'office space', 'officer', 'coffee', 'of'):
+            Item.objects.create(key=key, value='something')
+
+        # everything containing text, shortest first
+        self.assertEqual(
+            ['officer', 'the office', 'office space'],
+            [i.key for i in Item.search('office', 25)],
+        )
+        self.assertEqual(['officer'], [i.key for i in Item.search('office', 1)])
+        self.assertEqual(['coffee'], [i.key for i in Item.search('FFE', 25)])
+        # sharing trigrams isn't enough, they have to contain text
+        Item.objects.create(key='ofice', value='typo')
+        self.assertEqual(['ofice'], [i.key for i in Item.search('ofice', 25)])
+        self.assertEqual([], Item.search('icef', 25))
+        self.assertEqual([], Item.search('nope', 25))
+        # too short for trigrams
+        self.assertEqual(
+            ['of', 'ofice', 'coffee', 'officer', 'the office', 'office space'],
+            sorted(
+                [i.key for i in Item.search('of', 25)],
+                key=lambda k: (len(k), k),
+            ),
+        )
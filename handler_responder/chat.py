@@ -2,9 +2,10 @@ from django.conf import settings
 from random import choice, shuffle
 from time import time
 
-from simone.handlers import Registry, only_public
+from simone.handlers import Registry, generations, only_public
+from .matcher import TriggerMatcher
 from .models import Response, Trigger
-from .util import tokenize
+from .util import tokens
 
 
 class Responder(object):
@@ -24,9 +25,12 @@ class Responder(object):
       .when <trigger> do not respond <response>
     '''
 
+    GENERATION = 'responder'
+
     def __init__(self, cooldown):
         self.cooldown = cooldown
         self._triggers = None
+        self._responses = None
         self._last = {}
 
     def config(self):
@@ -50,7 +54,7 @@ class Responder(object):
                 context.say(
                     f"I wouldn't respond with `{say}` to `{phrase}` in the frist place."
                 )
-            self._triggers = None
+            self._invalidate()
         elif ' respond ' in text:
             # adding a response
             phrase, say = text.split(' respond ', 1)
@@ -62,7 +66,7 @@ class Responder(object):
             context.say(
                 f'Got it. When someone says `{phrase}` I might respond `{say}`.'
             )
-            self._triggers = None
+            self._invalidate()
         else:
             # list responses
             phrase = text.strip()
@@ -77,35 +81,66 @@ class Responder(object):
             except Trigger.DoesNotExist:
                 context.say(f"I don't have any responses for `{text}`")
 
+    def _invalidate(self, bump=True):
+        self._triggers = None
+        self._responses = None
+        if bump:
+            # let the other workers know
+            generations.bump(self.GENERATION)
+
+    def _load(self):
+        # a single join pulls in every trigger that has responses along with
+        # them, triggers without any couldn't respond so they're not needed
+        phrases = {}
+        responses = {}
+        for trigger_id, phrase, say in Response.objects.values_list(
+            'trigger_id', 'trigger__phrase', 'say'
+        ):
+            phrases[trigger_id] = phrase
+            responses.setdefault(trigger_id, []).append(say)
+        self._responses = {t: tuple(r) for t, r in responses.items()}
+        self._triggers = TriggerMatcher(
+            (tokens(p), t) for t, p in phrases.items()
+        )
+
     @property
     def triggers(self):
         if self._triggers is None:
-            self._triggers = {
-                tokenize(t.phrase): t.id for t in Trigger.objects.all()
-            }
+            self._load()
 
         return self._triggers
 
+    @property
+    def responses(self):
+        if self._responses is None:
+            self._load()
+
+        return self._responses
+
     def message(self, context, text, **kwargs):
         if (time() - self._last.get(context.channel_id, 0)) <= self.cooldown:
             # we've responded in this channel recently
             return
-        tokens = tokenize(text)
-        # shuffle the triggers in case there are multiple matches so that we'll
-        # pick a "random" one
-        triggers = list(self.triggers.items())
-        shuffle(triggers)
-        for phrase, trigger_id in triggers:
-            # if the tokenized phrase appears in the tokenized text
-            if phrase in tokens:
-                # pick a random response
-                responses = list(Response.objects.filter(trigger_id=trigger_id))
-                if not responses:
-                    continue
-                response = choice(responses)
-                context.say(response.say)
-                self._last[context.channel_id] = time()
-                break
+        if generations.stale(self.GENERATION):
+            # another worker has changed things
+            self._invalidate(bump=False)
+        # find all of the triggers whose tokenized phrase appears in the
+        # tokenized text in one pass
+        trigger_ids = self.triggers.match(tokens(text))
+        # shuffle the matches in case there are multiple so that we'll pick a
+        # "random" one
+        shuffle(trigger_ids)
+        responses = self.responses
+        for trigger_id in trigger_ids:
+            # pick a random response
+            try:
+                say = choice(responses[trigger_id])
+            except KeyError:
+                # invalidated out from under us
+                continue
+            context.say(say)
+            self._last[context.channel_id] = time()
+            break
 
 
 cooldown = getattr(settings, 'RESPONDER_COOLDOWN', 300)
@@ -0,0 +1,82 @@
+from django.core.management.base import BaseCommand
+from random import Random, shuffle
+from time import time
+
+from handler_responder.matcher import TriggerMatcher
+
+
+class Command(BaseCommand):
+    '''
+    Benchmark comparing the Aho-Corasick trigger matcher against the previous
+    shuffle and substring test of every trigger with synthetic triggers and
+    messages.
+    '''
+
+    name = 'bench_responder'
+    help = 'Benchmark responder trigger matching'
+
+    LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--triggers', type=int, default=10000)
+        parser.add_argument('--messages', type=int, default=200)
+        parser.add_argument('--vocabulary', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def _word(self, rand):
+        return ''.join(
+            rand.choice(self.LETTERS) for _ in range(rand.randint(2, 8))
+        )
+
+    def _scan(self, triggers, tokens):
+        # the pre-matcher implementation of Responder.message, returning the
+        # first match after shuffling
+        tokens = ':'.join(tokens)
+        triggers = list(triggers.items())
+        shuffle(triggers)
+        for phrase, trigger_id in triggers:
+            if phrase in tokens:
+                return trigger_id
+        return None
+
+    def handle(self, *args, **options):
+        rand = Random(options['seed'])
+        vocabulary = list(
+            set(self._word(rand) for _ in range(options['vocabulary']))
+        )
+
+        phrases = set()
+        while len(phrases) < options['triggers']:
+            n = rand.randint(1, 3)
+            phrases.add(tuple(rand.choice(vocabulary) for _ in range(n)))
+        phrases = sorted(phrases)
+        triggers = {':'.join(p): i for i, p in enumerate(phrases)}
+
+        messages = [
+            [rand.choice(vocabulary) for _ in range(rand.randint(3, 30))]
+            for _ in range(options['messages'])
+        ]
+
+        start = time()
+        matcher = TriggerMatcher((p, i) for i, p in enumerate(phrases))
+        build = time() - start
+        self.stdout.write(
+            f'triggers={len(phrases)}, messages={len(messages)}, '
+            f'build={1000 * build:.3f}ms'
+        )
+
+        start = time()
+        scanned = [self._scan(triggers, m) for m in messages]
+        elapsed = time() - start
+        self.stdout.write(
+            f'   scan: per_message={1000 * elapsed / len(messages):.3f}ms, '
+            f'matched={len([s for s in scanned if s is not None])}'
+        )
+
+        start = time()
+        matched = [matcher.match(m) for m in messages]
+        elapsed = time() - start
+        self.stdout.write(
+            f'matcher: per_message={1000 * elapsed / len(messages):.3f}ms, '
+            f'matched={len([m for m in matched if m])}'
+        )
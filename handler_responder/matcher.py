@@ -0,0 +1,69 @@
+from collections import deque
+
+
+class TriggerMatcher(object):
+    '''
+    Aho-Corasick automaton over tokens, rather than characters, so that
+    phrases only match on token boundaries and all of the phrases in a
+    message are found in a single pass over its tokens.
+    '''
+
+    def __init__(self, phrases=()):
+        # state 0 is the root, each state has a dict of token -> next state,
+        # a failure link, and the values of the phrases that end there
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for tokens, value in phrases:
+            self._add(tokens, value)
+        self._link()
+
+    def _add(self, tokens, value):
+        if not tokens:
+            # an empty phrase would match everything
+            return
+        state = 0
+        for token in tokens:
+            try:
+                state = self._goto[state][token]
+            except KeyError:
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._goto[state][token] = len(self._goto) - 1
+                state = len(self._goto) - 1
+        self._out[state].append(value)
+
+    def _link(self):
+        # breadth first so that the failure links of shallower states are
+        # in place before they're needed by deeper ones
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, child in self._goto[state].items():
+                queue.append(child)
+                fail = self._fail[state]
+                while fail and token not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(token, 0)
+                self._fail[child] = fail
+                # anything that ends at our failure state ends here too
+                self._out[child] = self._out[child] + self._out[fail]
+
+    def match(self, tokens):
+        '''
+        Returns a list of the unique values of all the phrases that appear in
+        tokens, in the order they were first found.
+        '''
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        ret = {}
+        state = 0
+        for token in tokens:
+            while state and token not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token, 0)
+            for value in out[state]:
+                ret[value] = True
+        return list(ret.keys())
@@ -0,0 +1,193 @@
+from django.test import TestCase
+from mock import MagicMock, patch
+from nltk.tokenize import NLTKWordTokenizer
+from random import Random
+from time import time
+
+from simone.handlers import _Generations
+
+from .chat import Responder
+from .matcher import TriggerMatcher
+from .models import Response, Trigger
+from .util import regex_tokens, strip_punctuation, tokenize
+
+
+class TestTriggerMatcher(TestCase):
+    def test_match(self):
+        matcher = TriggerMatcher(
+            (
+                (['cat'], 'cat'),
+                (['black', 'cat'], 'black cat'),
+                (['a', 'black', 'dog'], 'a black dog'),
+                (['black', 'cats'], 'black cats'),
+                ([], 'empty'),
+            )
+        )
+
+        self.assertEqual(
+            ['black cat', 'cat'],
+            sorted(matcher.match(['i', 'saw', 'a', 'black', 'cat'])),
+        )
+        # failure links take us from a partial match of one phrase into
+        # another
+        self.assertEqual(
+            ['a black dog'], matcher.match(['saw', 'a', 'black', 'dog'])
+        )
+        # each match is only returned once
+        self.assertEqual(['cat'], matcher.match(['cat', 'and', 'cat']))
+        # only on token boundaries
+        self.assertEqual([], matcher.match(['concatenate', 'cats']))
+        self.assertEqual(['black cats'], matcher.match(['black', 'cats']))
+        self.assertEqual([], matcher.match([]))
+
+
+# tokenization is tested elsewhere, keep these independent of it
+@patch('handler_responder.chat.tokens', lambda s: s.lower().split())
+class TestResponder(TestCase):
+    def setUp(self):
+        # start each test without any knowledge of generations
+        patcher = patch(
+            'handler_responder.chat.generations', _Generations(interval=30)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_message(self):
+        trigger = Trigger.objects.create(phrase='good morning')
+        Response.objects.create(trigger=trigger, say='morning!')
+        Response.objects.create(trigger=trigger, say='is it?')
+        # no responses, can't match
+        Trigger.objects.create(phrase='hello')
+
+        responder = Responder(cooldown=0)
+        context = MagicMock()
+        context.channel_id = 'C42'
+
+        # a generation check and then everything is loaded in a single query
+        with self.assertNumQueries(2):
+            responder.message(context, text='Good morning everyone')
+        self.assertIn(context.say.call_args[0][0], ('morning!', 'is it?'))
+
+        # after that there are no queries at all until it's time to check the
+        # generation again
+        context.reset_mock()
+        with self.assertNumQueries(0):
+            responder.message(context, text='good morning')
+            responder.message(context, text='hello there')
+        self.assertEqual(1, context.say.call_count)
+
+    def test_invalidation(self):
+        responder = Responder(cooldown=0)
+        context = MagicMock()
+        context.channel_id = 'C42'
+        responder.message(context, text='hello')
+        context.say.assert_not_called()
+
+        Response.objects.create(
+            trigger=Trigger.objects.create(phrase='hello'), say='hi!'
+        )
+        # cached, so we don't know about it yet
+        responder.message(context, text='hello')
+        context.say.assert_not_called()
+
+        responder._invalidate()
+        responder.message(context, text='hello')
+        context.say.assert_called_once_with('hi!')
+
+    def test_other_worker(self):
+        responder = Responder(cooldown=0)
+        context = MagicMock()
+        context.channel_id = 'C42'
+        responder.message(context, text='hello')
+
+        # another worker adds a response and bumps the generation
+        Response.objects.create(
+            trigger=Trigger.objects.create(phrase='hello'), say='hi!'
+        )
+        other = _Generations(interval=0)
+        other.bump(Responder.GENERATION)
+
+        # we'll notice once our check interval has passed
+        responder.message(context, text='hello')
+        context.say.assert_not_called()
+        with patch('simone.handlers.time', return_value=time() + 31):
+            responder.message(context, text='hello')
+        context.say.assert_called_once_with('hi!')
+
+
+class TestTokenize(TestCase):
+    CORPUS = (
+        'good morning',
+        'Good Morning!!',
+        "I can't even",
+        'i cannot believe it',
+        "gonna gotta wanna lemme gimme",
+        'wanna',
+        'wannabe cannotx',
+        'the "quotes" and (parens) [brackets] {braces}',
+        '“smart quotes” ‘single’ «chevrons» „low',
+        'dashes – and — and ‒ and ―',
+        'e-mail me @ home #hashtag $5 & 100%',
+        'ellipsis... and … unicode',
+        "it's o'clock y'all don't won't",
+        'tabs\tand\nnewlines   and  spaces',
+        'café naïve 日本語 emoji 🎉',
+        '',
+        '   ',
+        '!!!',
+    )
+
+    def assertCompatible(self, text):
+        # word_tokenize is sentence tokenization followed by
+        # NLTKWordTokenizer. Sentences are only split on punctuation, which
+        # has been stripped, so comparing against NLTKWordTokenizer covers it
+        # without needing the punkt data
+        text = strip_punctuation(text.lower())
+        self.assertEqual(
+            NLTKWordTokenizer().tokenize(text), regex_tokens(text), text
+        )
+
+    def test_corpus(self):
+        for text in self.CORPUS:
+            self.assertCompatible(text)
+
+    def test_random(self):
+        rand = Random(42)
+        pieces = (
+            'a',
+            'b',
+            'can',
+            'not',
+            'cannot',
+            'wan',
+            'na',
+            'wanna',
+            'gon',
+            'got',
+            'ta',
+            'lem',
+            'gim',
+            'me',
+            ' ',
+            '  ',
+            '\t',
+            "'",
+            '"',
+            '“',
+            '”',
+            '—',
+            '-',
+            '.',
+            'é',
+            '\u2011',
+            '•',
+            '™',
+        )
+        for _ in range(2000):
+            text = ''.join(
+                rand.choice(pieces) for _ in range(rand.randint(0, 12))
+            )
+            self.assertCompatible(text)
+
+    def test_tokenize(self):
+        self.assertEqual('i:can:not:wait', tokenize("I cannot wait!"))
@@ -1,12 +1,50 @@
-from nltk.tokenize import word_tokenize
+from django.conf import settings
 from string import punctuation
+import re
 
 _PUNCT_TRANS = str.maketrans('', '', punctuation)
 
+# What's left of NLTK's word_tokenize once ASCII punctuation has been
+# stripped: unicode quotes & dashes become their own tokens and a handful of
+# contractions are split in two. Sentence splitting only happens on
+# punctuation so there's nothing for it to do.
+_RE_QUOTES_DASHES = re.compile('([«“‘„»”’\u2012-\u2015])')
+_RE_CONTRACTIONS = re.compile(
+    r'\b(?:(can)(not)|(gim)(me)|(gon)(na)|(got)(ta)|(lem)(me))\b'
+    r'|\b(wan)(na)(?=\s|$)'
+)
+
+
+def _split_contraction(match):
+    # padded like NLTK's r' \1 \2 ' so that neighbouring symbols, which \b
+    # doesn't split on, end up in tokens of their own
+    return ' {} {} '.format(*(g for g in match.groups() if g is not None))
+
 
 def strip_punctuation(s):
     return s.translate(_PUNCT_TRANS)
 
 
+def regex_tokens(s):
+    s = _RE_QUOTES_DASHES.sub(r' \1 ', s)
+    s = _RE_CONTRACTIONS.sub(_split_contraction, s)
+    return s.split()
+
+
+def nltk_tokens(s):
+    # only imported if configured, it's slow to load
+    from nltk.tokenize import word_tokenize
+
+    return word_tokenize(s)
+
+
+_TOKENIZERS = {'nltk': nltk_tokens, 'regex': regex_tokens}
+_tokenizer = _TOKENIZERS[getattr(settings, 'RESPONDER_TOKENIZER', 'regex')]
+
+
+def tokens(s):
+    return _tokenizer(strip_punctuation(s.lower()))
+
+
 def tokenize(s):
-    return ':'.join(word_tokenize(strip_punctuation(s.lower())))
+    return ':'.join(tokens(s))
@@ -1,6 +1,12 @@
+from django.conf import settings
+from django.db import transaction
 from io import StringIO
 
 from simone.handlers import Registry, exclude_private
+from simone.scheduler import scheduler
+from .counter import SparkleCounter
+from .leaderboard import Leaderboard
+from .ledger import Ledger
 from .models import User
 
 
@@ -19,20 +25,34 @@ class Sparkles(object):
 
       To see the most sparkly people
         .sparkly
+        .sparkly week|month
     '''
 
+    WINDOWS = {'week': 7, 'month': 30}
+
+    def __init__(self, counter, leaderboard, ledger):
+        self.counter = counter
+        self.leaderboard = leaderboard
+        self.ledger = ledger
+
     def config(self):
         return {'commands': ('sparkle', 'sparkles', 'sparkly')}
 
     @exclude_private
     def command(self, context, command, text, mentions, sender, **kwargs):
         if command == 'sparkly':
+            window = text.strip().lower()
             buf = StringIO()
-            buf.write('Sparkly people:\n')
-            for user in User.objects.order_by('-sparkles')[:10]:
-                buf.write(f'{user.sparkles:4d}')
+            if window in self.WINDOWS:
+                buf.write(f'Sparkly people this {window}:\n')
+                top = self.ledger.top(self.WINDOWS[window])
+            else:
+                buf.write('Sparkly people:\n')
+                top = self.leaderboard.top()
+            for user_id, sparkles in top:
+                buf.write(f'{sparkles:4d}')
                 buf.write(' - ')
-                buf.write(context.user_mention(user.user_id))
+                buf.write(context.user_mention(user_id))
                 buf.write('\n')
             context.say(buf.getvalue())
             return
@@ -58,22 +78,30 @@ class Sparkles(object):
             buf.write(text)
             buf.write('\n')
 
+        totals = self.counter.grant(mentions)
+        # until the grant commits other workers can't see it and it may yet
+        # be rolled back
+        transaction.on_commit(lambda: self.leaderboard.update(totals))
+        reason = text.split(' for ', 1)[1] if ' for ' in text else ''
+        self.ledger.record(sender, mentions, context.channel_id, reason)
         for user_id in mentions:
-            try:
-                user = User.objects.get(user_id=user_id)
-                # We're in a transation so no need to do an F() + 1
-                user.sparkles = user.sparkles + 1
-                user.save()
-            except User.DoesNotExist:
-                user = User.objects.create(user_id=user_id, sparkles=1)
-
             buf.write(':tada: ')
             buf.write(context.user_mention(user_id))
             buf.write(' has ')
-            buf.write(str(user.sparkles))
+            buf.write(str(totals[user_id]))
             buf.write(' :sparkles:s\n')
 
         context.say(buf.getvalue())
 
 
-Registry.register_handler(Sparkles())
+Registry.register_handler(
+    Sparkles(
+        SparkleCounter(),
+        Leaderboard(
+            size=getattr(settings, 'SPARKLES_LEADERBOARD_SIZE', 10),
+            interval=getattr(settings, 'SPARKLES_LEADERBOARD_INTERVAL', 300),
+            scheduler=scheduler,
+        ),
+        Ledger(),
+    )
+)
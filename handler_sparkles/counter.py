@@ -0,0 +1,62 @@
+from collections import Counter, defaultdict
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Now
+from logging import getLogger
+
+from .models import User
+
+
+class SparkleCounter(object):
+    '''
+    Applies a batch of sparkles with a fixed number of queries no matter how
+    many users are involved.
+
+    Increments are done by the database with F() so that concurrent grants
+    to the same user can't lose updates.
+    '''
+
+    log = getLogger('SparkleCounter')
+
+    def grant(self, user_ids):
+        '''
+        user_ids may contain duplicates, each one is a sparkle. Returns a dict
+        of user_id -> new total.
+        '''
+        counts = Counter(user_ids)
+        if not counts:
+            return {}
+        self.log.debug('grant: counts=%s', counts)
+
+        # make sure everyone has a row to increment, existing ones are left
+        # alone
+        User.objects.bulk_create(
+            [User(user_id=user_id, sparkles=0) for user_id in counts],
+            ignore_conflicts=True,
+        )
+
+        # a single update for the whole batch, users getting the same number
+        # of sparkles share a When
+        by_n = defaultdict(list)
+        for user_id, n in counts.items():
+            by_n[n].append(user_id)
+        User.objects.filter(user_id__in=counts.keys()).update(
+            sparkles=F('sparkles')
+            + Case(
+                *[
+                    When(user_id__in=ids, then=Value(n))
+                    for n, ids in by_n.items()
+                ],
+                default=Value(0),
+            ),
+            # update doesn't go through save so auto_now won't kick in
+            updated_at=Now(),
+        )
+
+        # commands run in a transaction so the update's row locks are held
+        # until it commits and these are the totals that include our
+        # increments
+        return dict(
+            User.objects.filter(user_id__in=counts.keys()).values_list(
+                'user_id', 'sparkles'
+            )
+        )
@@ -0,0 +1,89 @@
+from bisect import insort
+from django.db import close_old_connections
+from logging import getLogger
+from threading import Lock
+
+from .models import User
+
+
+class Leaderboard(object):
+    '''
+    The size most sparkly users, kept in memory so that it can be served
+    without a query.
+
+    Sparkles only ever go up so applying each grant's new totals keeps the
+    board exact for this process. Other workers' grants are picked up when
+    it's reconciled with the database every interval seconds, the larger of
+    the two totals winning so that a reconcile can't undo a grant that
+    committed while it was reading. Loading is put off until first use, or
+    the first reconcile, since the table may not exist yet at construction.
+    '''
+
+    log = getLogger('Leaderboard')
+
+    def __init__(self, size=10, interval=300, scheduler=None):
+        self.size = size
+        self.interval = interval
+        self.scheduler = scheduler
+
+        # sorted list of (-sparkles, user_id)
+        self._board = []
+        self._lock = Lock()
+        self._warmed = False
+        self._scheduled = False
+
+    def warm(self):
+        # order matches the board's so that ties come out the same
+        board = [
+            (-sparkles, user_id)
+            for user_id, sparkles in User.objects.order_by(
+                '-sparkles', 'user_id'
+            ).values_list('user_id', 'sparkles')[: self.size]
+        ]
+        with self._lock:
+            totals = {user_id: -sparkles for sparkles, user_id in board}
+            for sparkles, user_id in self._board:
+                totals[user_id] = max(totals.get(user_id, 0), -sparkles)
+            board = sorted(
+                (-sparkles, user_id) for user_id, sparkles in totals.items()
+            )[: self.size]
+            self._board = board
+            self._warmed = True
+            # the first warm kicks off the reconciling
+            if self.scheduler and not self._scheduled:
+                self.scheduler.schedule(self.interval, self._reconcile)
+                self._scheduled = True
+        self.log.debug('warm: board=%s', board)
+
+    def _reconcile(self):
+        # runs on a scheduler thread
+        close_old_connections()
+        try:
+            self.warm()
+        finally:
+            close_old_connections()
+            self.scheduler.schedule(self.interval, self._reconcile)
+
+    def update(self, totals):
+        '''
+        totals is a dict of user_id -> new sparkle total, they must have
+        been committed, see Sparkles.command
+        '''
+        if not self._warmed:
+            # the totals are already in the database so loading the board
+            # picks them up
+            self.warm()
+            return
+        with self._lock:
+            board = [e for e in self._board if e[1] not in totals]
+            for user_id, sparkles in totals.items():
+                insort(board, (-sparkles, user_id))
+            self._board = board[: self.size]
+
+    def top(self):
+        '''
+        Returns a list of (user_id, sparkles), most sparkly first.
+        '''
+        if not self._warmed:
+            self.warm()
+        return [(user_id, -sparkles) for sparkles, user_id in self._board]
@@ -0,0 +1,91 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+from django.db.models import Case, F, Sum, Value, When
+from django.utils import timezone
+from logging import getLogger
+
+from .models import Sparkle, SparkleDay
+
+
+class Ledger(object):
+    '''
+    Records every sparkle given and keeps the SparkleDay rollups up to date
+    as it goes so that windowed questions are answered by summing at most a
+    row per user per day rather than scanning the ledger.
+    '''
+
+    log = getLogger('Ledger')
+
+    def record(self, giver, user_ids, channel_id, reason=''):
+        counts = Counter(user_ids)
+        if not counts:
+            return
+        self.log.debug(
+            'record: giver=%s, counts=%s, channel_id=%s',
+            giver,
+            counts,
+            channel_id,
+        )
+
+        Sparkle.objects.bulk_create(
+            [
+                Sparkle(
+                    giver=giver,
+                    receiver=user_id,
+                    channel_id=channel_id,
+                    reason=reason,
+                )
+                for user_id in user_ids
+            ]
+        )
+
+        # same approach as SparkleCounter, make sure the day's rows exist and
+        # then increment them all in a single update
+        day = timezone.now().date()
+        SparkleDay.objects.bulk_create(
+            [SparkleDay(day=day, receiver=user_id) for user_id in counts],
+            ignore_conflicts=True,
+        )
+        by_n = defaultdict(list)
+        for user_id, n in counts.items():
+            by_n[n].append(user_id)
+        SparkleDay.objects.filter(day=day, receiver__in=counts.keys()).update(
+            sparkles=F('sparkles')
+            + Case(
+                *[
+                    When(receiver__in=ids, then=Value(n))
+                    for n, ids in by_n.items()
+                ],
+                default=Value(0),
+            )
+        )
+
+    def _since(self, days):
+        # today counts as one of the days
+        return timezone.now().date() - timedelta(days=days - 1)
+
+    def top(self, days, limit=10):
+        '''
+        Returns a list of (user_id, sparkles) for the most sparkly users over
+        the last days days, including today.
+        '''
+        return list(
+            SparkleDay.objects.filter(day__gte=self._since(days))
+            .values('receiver')
+            .annotate(total=Sum('sparkles'))
+            .order_by('-total', 'receiver')
+            .values_list('receiver', 'total')[:limit]
+        )
+
+    def history(self, user_id, days):
+        '''
+        Returns a list of (day, sparkles) for the days user_id received
+        sparkles over the last days days, oldest first.
+        '''
+        return list(
+            SparkleDay.objects.filter(
+                receiver=user_id, day__gte=self._since(days)
+            )
+            .order_by('day')
+            .values_list('day', 'sparkles')
+        )
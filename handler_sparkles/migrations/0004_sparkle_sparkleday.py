@@ -0,0 +1,59 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [('handler_sparkles', '0003_alter_user_sparkles')]
+
+    operations = [
+        migrations.CreateModel(
+            name='SparkleDay',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                ('day', models.DateField(db_index=True)),
+                ('receiver', models.CharField(max_length=16)),
+                ('sparkles', models.IntegerField(default=0)),
+            ],
+            options={'unique_together': {('receiver', 'day')}},
+        ),
+        migrations.CreateModel(
+            name='Sparkle',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                ('giver', models.CharField(max_length=16)),
+                ('receiver', models.CharField(max_length=16)),
+                ('channel_id', models.CharField(max_length=16)),
+                ('reason', models.TextField(blank=True)),
+                (
+                    'created_at',
+                    models.DateTimeField(auto_now_add=True, db_index=True),
+                ),
+            ],
+            options={
+                'indexes': [
+                    models.Index(
+                        fields=['receiver', 'created_at'],
+                        name='handler_spa_receive_6b8bda_idx',
+                    )
+                ]
+            },
+        ),
+    ]
@@ -10,3 +10,38 @@ class User(models.Model):
 
     def __str__(self):
         return f'{self.user_id} - {self.sparkles}'
+
+
+class Sparkle(models.Model):
+    '''
+    Append-only ledger with a row for each sparkle given.
+    '''
+
+    giver = models.CharField(max_length=16)
+    receiver = models.CharField(max_length=16)
+    channel_id = models.CharField(max_length=16)
+    reason = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = (models.Index(fields=('receiver', 'created_at')),)
+
+    def __str__(self):
+        return f'{self.giver} -> {self.receiver} - {self.created_at}'
+
+
+class SparkleDay(models.Model):
+    '''
+    Daily rollup of the ledger, the number of sparkles receiver got on day.
+    '''
+
+    day = models.DateField(db_index=True)
+    receiver = models.CharField(max_length=16)
+    sparkles = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('receiver', 'day'),)
+
+    def __str__(self):
+        return f'{self.day} - {self.receiver} - {self.sparkles}'
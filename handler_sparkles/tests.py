@@ -0,0 +1,176 @@
+from datetime import date, datetime, timezone
+from django.test import TestCase
+from mock import MagicMock, patch
+
+from simone.context import ChannelType
+from .chat import Sparkles
+from .counter import SparkleCounter
+from .leaderboard import Leaderboard
+from .ledger import Ledger
+from .models import Sparkle, SparkleDay, User
+
+
+class TestSparkleCounter(TestCase):
+    def test_grant(self):
+        counter = SparkleCounter()
+        self.assertEqual({}, counter.grant([]))
+
+        User.objects.create(user_id='U1', sparkles=5)
+        User.objects.create(user_id='U9', sparkles=7)
+        # an upsert, an update and reading back the totals, regardless of how
+        # many users there are
+        with self.assertNumQueries(3):
+            totals = counter.grant(['U1', 'U2', 'U3', 'U1'])
+        self.assertEqual({'U1': 7, 'U2': 1, 'U3': 1}, totals)
+        self.assertEqual(
+            {'U1': 7, 'U2': 1, 'U3': 1, 'U9': 7},
+            dict(User.objects.values_list('user_id', 'sparkles')),
+        )
+
+
+class TestLedger(TestCase):
+    @patch('handler_sparkles.ledger.timezone.now')
+    def test_ledger(self, now_mock):
+        ledger = Ledger()
+
+        now_mock.return_value = datetime(2021, 10, 1, tzinfo=timezone.utc)
+        ledger.record('U0', ['U1', 'U2', 'U1'], 'C1', 'reasons')
+        now_mock.return_value = datetime(2021, 10, 20, tzinfo=timezone.utc)
+        ledger.record('U1', ['U2'], 'C1')
+        # a ledger insert, upserting the rollups and incrementing them
+        with self.assertNumQueries(3):
+            ledger.record('U1', ['U2', 'U3'], 'C2')
+
+        self.assertEqual(6, Sparkle.objects.count())
+        self.assertEqual(
+            [
+                (date(2021, 10, 1), 'U1', 2),
+                (date(2021, 10, 1), 'U2', 1),
+                (date(2021, 10, 20), 'U2', 2),
+                (date(2021, 10, 20), 'U3', 1),
+            ],
+            list(
+                SparkleDay.objects.order_by('day', 'receiver').values_list(
+                    'day', 'receiver', 'sparkles'
+                )
+            ),
+        )
+
+        self.assertEqual([('U2', 2), ('U3', 1)], ledger.top(7))
+        self.assertEqual([('U2', 3), ('U1', 2), ('U3', 1)], ledger.top(30))
+        self.assertEqual([('U2', 3)], ledger.top(30, limit=1))
+        self.assertEqual(
+            [(date(2021, 10, 1), 1), (date(2021, 10, 20), 2)],
+            ledger.history('U2', 30),
+        )
+        self.assertEqual([], ledger.history('U1', 7))
+
+
+class TestLeaderboard(TestCase):
+    def test_leaderboard(self):
+        for i in range(5):
+            User.objects.create(user_id=f'U{i}', sparkles=i * 10)
+        scheduler = MagicMock()
+        leaderboard = Leaderboard(size=3, interval=42, scheduler=scheduler)
+
+        # loaded once, reconciling is scheduled, then served from memory
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                [('U4', 40), ('U3', 30), ('U2', 20)], leaderboard.top()
+            )
+            self.assertEqual(
+                [('U4', 40), ('U3', 30), ('U2', 20)], leaderboard.top()
+            )
+        scheduler.schedule.assert_called_once_with(42, leaderboard._reconcile)
+
+        with self.assertNumQueries(0):
+            # moving up, a newcomer, and one that doesn't make the cut
+            leaderboard.update({'U2': 35, 'U5': 50, 'U0': 1})
+            self.assertEqual(
+                [('U5', 50), ('U4', 40), ('U2', 35)], leaderboard.top()
+            )
+            # ties are broken by user_id
+            leaderboard.update({'U3': 40})
+            self.assertEqual(
+                [('U5', 50), ('U3', 40), ('U4', 40)], leaderboard.top()
+            )
+
+        # another worker's changes are picked up when reconciling, which then
+        # schedules itself again. Our updates never made it to the database
+        # here, they stand in for grants that committed after the reconcile
+        # read and are kept
+        User.objects.filter(user_id='U1').update(sparkles=99)
+        scheduler.reset_mock()
+        leaderboard._reconcile()
+        self.assertEqual(
+            [('U1', 99), ('U5', 50), ('U3', 40)], leaderboard.top()
+        )
+        scheduler.schedule.assert_called_once_with(42, leaderboard._reconcile)
+
+
+class TestSparkles(TestCase):
+    def test_sparkle(self):
+        User.objects.create(user_id='U1', sparkles=41)
+        sparkles = Sparkles(SparkleCounter(), Leaderboard(), Ledger())
+        context = MagicMock()
+        context.channel_type = ChannelType.PUBLIC
+        context.channel_id = 'C42'
+        context.user_mention = lambda user_id: f'<@{user_id}>'
+
+        # the board is only updated once the grant commits
+        with self.captureOnCommitCallbacks() as callbacks:
+            sparkles.command(
+                context,
+                command='sparkle',
+                text='<@U1> and <@U2> for being great',
+                mentions=['U1', 'U2'],
+                sender='U0',
+                dispatcher=None,
+            )
+        self.assertFalse(sparkles.leaderboard._warmed)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(
+            'Sparkling <@U1> and <@U2> for being great\n'
+            ':tada: <@U1> has 42 :sparkles:s\n'
+            ':tada: <@U2> has 1 :sparkles:s\n',
+            context.say.call_args[0][0],
+        )
+
+        with self.assertNumQueries(0):
+            sparkles.command(
+                context,
+                command='sparkly',
+                text='',
+                mentions=[],
+                sender='U0',
+                dispatcher=None,
+            )
+        self.assertEqual(
+            'Sparkly people:\n  42 - <@U1>\n   1 - <@U2>\n',
+            context.say.call_args[0][0],
+        )
+
+        self.assertEqual(
+            [
+                ('U0', 'U1', 'C42', 'being great'),
+                ('U0', 'U2', 'C42', 'being great'),
+            ],
+            list(
+                Sparkle.objects.order_by('receiver').values_list(
+                    'giver', 'receiver', 'channel_id', 'reason'
+                )
+            ),
+        )
+        sparkles.command(
+            context,
+            command='sparkly',
+            text='week',
+            mentions=[],
+            sender='U0',
+            dispatcher=None,
+        )
+        self.assertEqual(
+            'Sparkly people this week:\n   1 - <@U1>\n   1 - <@U2>\n',
+            context.say.call_args[0][0],
+        )
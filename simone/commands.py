@@ -0,0 +1,101 @@
+class CommandTrie(object):
+    '''
+    Token trie of registered commands supporting longest-prefix matching.
+
+    Each node is a dict mapping the next command word to its child node. The
+    handler for a command that terminates at a node is stored under the
+    `None` key since command words are never `None`.
+    '''
+
+    def __init__(self, user_placeholder, channel_placeholder):
+        self.user_placeholder = user_placeholder
+        self.channel_placeholder = channel_placeholder
+        self._root = {}
+
+    def normalize(self, piece):
+        if piece.startswith('<@'):
+            return self.user_placeholder
+        elif piece.startswith('<#'):
+            return self.channel_placeholder
+        return piece
+
+    def add(self, command_words, handler):
+        node = self._root
+        for word in command_words:
+            node = node.setdefault(word, {})
+        node[None] = handler
+
+    def match(self, pieces):
+        '''
+        Walks pieces through the trie in a single pass returning a tuple of
+        (handler, n) for the longest registered command that prefixes pieces
+        or (None, 0) if nothing matches.
+        '''
+        handler = None
+        n = 0
+        node = self._root
+        for i, piece in enumerate(pieces):
+            node = node.get(self.normalize(piece))
+            if node is None:
+                break
+            try:
+                handler = node[None]
+                n = i + 1
+            except KeyError:
+                pass
+        return (handler, n)
+
+
+class BKTree(object):
+    '''
+    Burkhard-Keller tree over a set of strings for finding those within a
+    given edit distance of a query without comparing it to every one of them.
+
+    Nodes are (value, children) tuples where children is a dict mapping the
+    distance from value to the child node.
+    '''
+
+    def __init__(self, distance, values=()):
+        self.distance = distance
+        self._root = None
+        for value in values:
+            self.add(value)
+
+    def add(self, value):
+        if self._root is None:
+            self._root = (value, {})
+            return
+        node_value, children = self._root
+        while True:
+            d = self.distance(value, node_value)
+            if d == 0:
+                # already have it
+                return
+            try:
+                node_value, children = children[d]
+            except KeyError:
+                children[d] = (value, {})
+                return
+
+    def search(self, query, radius):
+        '''
+        Returns a list of (distance, value) for all of the values within
+        radius of query.
+        '''
+        ret = []
+        if self._root is None:
+            return ret
+        stack = [self._root]
+        while stack:
+            value, children = stack.pop()
+            d = self.distance(query, value)
+            if d <= radius:
+                ret.append((d, value))
+            # triangle inequality, only children whose distance from this node
+            # is within radius of d can possibly be within radius of query
+            low = d - radius
+            high = d + radius
+            for child_d, child in children.items():
+                if low <= child_d <= high:
+                    stack.append(child)
+        return ret
@@ -1,6 +1,8 @@
 from enum import Enum
 from time import sleep
 
+from .scheduler import scheduler
+
 
 class ChannelType(Enum):
     PUBLIC = 'public'
@@ -44,17 +46,38 @@ class BaseContext(object):
         '''
         raise NotImplementedError('say is not implemented')
 
+    def _pause(self, texts, pauses, i):
+        try:
+            return pauses[i]
+        except (IndexError, TypeError):
+            # The average human can type 190 to 200 wpm, simone is above
+            # average and not human so let's say 225.
+            # 225 wpm / 60 s = 3.75 wsp
+            return len(texts[i].split(' ')) / 3.75
+
+    def _converse(self, texts, pauses, i, kwargs):
+        self.say(texts[i], **kwargs)
+        if i + 1 < len(texts):
+            # the next message is only scheduled once this one has been sent
+            # so the conversation stays in order
+            scheduler.schedule(
+                self._pause(texts, pauses, i),
+                self._converse,
+                texts,
+                pauses,
+                i + 1,
+                kwargs,
+            )
+
     def converse(self, texts, pauses=None, **kwargs):
-        for i, text in enumerate(texts):
-            self.say(text, **kwargs)
-            try:
-                pause = pauses[i]
-            except (IndexError, TypeError):
-                # The average human can type 190 to 200 wpm, simone is above
-                # average and not human so let's say 225.
-                # 225 wpm / 60 s = 3.75 wsp
-                pause = len(text.split(' ')) / 3.75
-            sleep(pause)
+        '''
+        Says texts one after another with pauses between them. The first is
+        sent immediately and the rest are sent in the background so that
+        we're not holding on to a worker for the whole conversation.
+        '''
+        texts = list(texts)
+        if texts:
+            self._converse(texts, pauses, 0, kwargs)
 
     def react(self, emoji):
         '''
@@ -92,6 +115,14 @@ class ConsoleContext(BaseContext):
             text = f'> {text}'
         print(text)
 
+    def converse(self, texts, pauses=None, **kwargs):
+        # management commands exit once they've dispatched so there's no
+        # background to send things in, we just have to wait
+        texts = list(texts)
+        for i, text in enumerate(texts):
+            self.say(text, **kwargs)
+            sleep(self._pause(texts, pauses, i))
+
     def react(self, emoji):
         self.app.client.reactions_add(
             channel=self.channel_id, name=emoji, timestamp=self.timestamp
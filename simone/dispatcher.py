@@ -1,33 +1,105 @@
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 from cron_validator import CronValidator
 from datetime import datetime
 from django.conf import settings
 from django.db import close_old_connections, transaction
-from functools import wraps
+from django.urls import path
+from functools import partial, wraps
 from io import StringIO
 from logging import getLogger
+from math import ceil
 from os import environ
 from pprint import pformat, pprint
 from pylev import levenshtein
 from slack_bolt import App
-from time import time
+from time import perf_counter, time
 from threading import Event, Thread
 
 from slacker.listeners import SlackListener
+from .commands import BKTree, CommandTrie
+from .handlers import InstrumentedExecutor, max_outbound
+from .metrics import metrics
+from .views import metrics_view
 
 max_dispatchers = getattr(settings, 'MAX_DISPATCHERS', 10)
-executor = ThreadPoolExecutor(
-    max_workers=max_dispatchers, thread_name_prefix='simone-worker'
+executor = InstrumentedExecutor(
+    'worker', max_workers=max_dispatchers, thread_name_prefix='simone-worker'
+)
+# message handlers fan out onto their own pool, they're submitted to from the
+# dispatch workers above and waited on so sharing that pool could deadlock
+# once it's saturated
+max_message_handlers = getattr(settings, 'MAX_MESSAGE_HANDLERS', 10)
+message_executor = InstrumentedExecutor(
+    'message',
+    max_workers=max_message_handlers,
+    thread_name_prefix='simone-message',
 )
 
+metrics.describe(
+    'simone_dispatch_seconds', 'histogram', 'Time spent dispatching events'
+)
+metrics.describe(
+    'simone_dispatch_errors_total', 'counter', 'Events that failed to dispatch'
+)
+metrics.describe(
+    'simone_dispatch_in_flight', 'gauge', 'Events currently being dispatched'
+)
+metrics.describe(
+    'simone_handler_seconds', 'histogram', 'Time spent in handler calls'
+)
+metrics.describe(
+    'simone_handler_errors_total', 'counter', 'Handler calls that raised'
+)
+metrics.describe(
+    'simone_handler_in_flight', 'gauge', 'Handler calls currently running'
+)
+metrics.describe(
+    'simone_message_handler_timeouts_total',
+    'counter',
+    'Message handlers that were given up on',
+)
+metrics.describe(
+    'simone_message_handlers_abandoned',
+    'gauge',
+    'Message handlers that were given up on and are still running',
+)
+metrics.gauge_callback(
+    'simone_executor_max_threads',
+    lambda: [
+        ((('executor', 'worker'),), max_dispatchers),
+        ((('executor', 'message'),), max_message_handlers),
+        ((('executor', 'outbound'),), max_outbound),
+    ],
+    'Threads the executor is allowed to start',
+)
+
+
+def _instrument(func, labels):
+    metrics.inc('simone_dispatch_in_flight', labels)
+    start = perf_counter()
+    try:
+        return func()
+    except Exception:
+        metrics.inc('simone_dispatch_errors_total', labels)
+        raise
+    finally:
+        metrics.observe(
+            'simone_dispatch_seconds', perf_counter() - start, labels
+        )
+        metrics.inc('simone_dispatch_in_flight', labels, -1)
+
 
 def dispatch_with_error_reporting(func):
+    labels = (('event', func.__name__),)
+
     @wraps(func)
     def wrap(self, context, *args, **kwargs):
         ret = None
         with transaction.atomic():
             try:
-                ret = func(self, context, *args, **kwargs)
+                ret = _instrument(
+                    lambda: func(self, context, *args, **kwargs), labels
+                )
             except Exception:
                 self.log.exception(
                     'dispatch failed: context=%s, args=%s, kwargs=%s',
@@ -44,15 +116,17 @@ def dispatch_with_error_reporting(func):
     return wrap
 
 
-# TODO: we should put each handler in its own try/except so that if one fails
-# it doesn't take out the others
 def dispatch(func):
+    labels = (('event', func.__name__),)
+
     @wraps(func)
     def wrap(self, context, *args, **kwargs):
         ret = None
         with transaction.atomic():
             try:
-                ret = func(self, context, *args, **kwargs)
+                ret = _instrument(
+                    lambda: func(self, context, *args, **kwargs), labels
+                )
             except Exception:
                 self.log.exception(
                     'dispatch failed: context=%s, args=%s, kwargs=%s',
@@ -91,8 +165,12 @@ class Dispatcher(object):
         commands = {}
         command_words = {}
         command_max_words = 0
+        command_trie = CommandTrie(
+            self.USER_PLACEHOLDER, self.CHANNEL_PLACEHOLDER
+        )
         joineds = []
         messages = []
+        starts = []
         for handler in handlers:
             config = handler.config()
             if config.get('added', False):
@@ -101,20 +179,33 @@ class Dispatcher(object):
                 command = tuple(command.split())
                 commands[' '.join(command)] = handler
                 command_words[command] = handler
+                command_trie.add(command, handler)
                 command_max_words = max(command_max_words, len(command))
             if config.get('joined', False):
                 joineds.append(handler)
             if config.get('messages', False):
                 messages.append(handler)
+            if config.get('start', False):
+                starts.append(handler)
         self.log.debug('__init__: command_words=%s', pformat(command_words))
 
+        # optional limit, in seconds, on how long we'll wait for message
+        # handlers to finish before giving up on them
+        self.message_timeout = getattr(
+            settings, 'MESSAGE_HANDLER_TIMEOUT', None
+        )
+
         self.addeds = addeds
         self.commands = commands
         self.command_words = command_words
         self.command_max_words = command_max_words
+        self.command_trie = command_trie
+        self.command_index = BKTree(levenshtein, sorted(commands.keys()))
         self._crons = None
         self.joineds = joineds
         self.messages = messages
+        self.starts = starts
+        self._started = False
 
     @property
     def crons(self):
@@ -138,33 +229,45 @@ class Dispatcher(object):
     def urlpatterns(self):
         return sum(
             [l.urlpatterns() for _, l in sorted(self.listeners.items())], []
-        )
+        ) + [path('metrics', metrics_view, name='metrics')]
+
+    def _call_handler(self, event, handler, method, *args, **kwargs):
+        labels = (('event', event), ('handler', handler.__class__.__name__))
+        metrics.inc('simone_handler_in_flight', labels)
+        start = perf_counter()
+        try:
+            return method(*args, **kwargs)
+        except Exception:
+            metrics.inc('simone_handler_errors_total', labels)
+            raise
+        finally:
+            metrics.observe(
+                'simone_handler_seconds', perf_counter() - start, labels
+            )
+            metrics.inc('simone_handler_in_flight', labels, -1)
 
     @dispatch
     def added(self, *args, **kwargs):
         for handler in self.addeds:
-            handler.added(*args, **kwargs)
+            self._call_handler('added', handler, handler.added, *args, **kwargs)
 
     def _did_you_mean(self, context, command_words):
-        # score commands for "distance" from the command we received
-        commands = []
-        for command in [' '.join(cw) for cw in command_words]:
-            commands += [
-                (levenshtein(command, name), name)
-                for name, _ in self.commands.items()
-            ]
-        # order them by ascending score
-        commands.sort()
-        # only include things that are close enough, within 50% matches
+        commands = [' '.join(cw) for cw in command_words]
+        # only include things that are close enough, within 50% matches of
+        # the shortest candidate
+        command = commands[-1]
         cutoff = len(command) * 0.5
+        # scores must be strictly less than the cutoff, they're ints so that's
+        # the same as being within the next lowest int
+        radius = ceil(cutoff) - 1
         # as a set to get rid of duplicates
-        potentials = set(
-            [
+        potentials = set()
+        for candidate in commands:
+            # the index prunes everything that can't be within radius
+            potentials.update(
                 f'{self.LEADER}{name}'
-                for score, name in commands
-                if score < cutoff
-            ]
-        )
+                for _, name in self.command_index.search(candidate, radius)
+            )
         # build the response
         buf = StringIO()
         buf.write('Sorry `')
@@ -194,38 +297,32 @@ class Dispatcher(object):
         # get rid of any leading and trailing space and generate our command
         # words
         pieces = text.strip().split()
-        # create a set of pieces with placeholders as appropriate
-        processed_pieces = []
-        for piece in pieces:
-            if piece.startswith('<@'):
-                # user placeholder
-                piece = self.USER_PLACEHOLDER
-            elif piece.startswith('<#'):
-                # channel placeholder
-                piece = self.CHANNEL_PLACEHOLDER
-            processed_pieces.append(piece)
+        # walk the trie once looking for the longest matching command,
+        # placeholders are handled by the trie as it goes
+        handler, n = self.command_trie.match(pieces)
+        if handler:
+            # we've found a match
+            command_words = [
+                tuple(self.command_trie.normalize(p) for p in pieces[:n])
+            ]
+            command = ' '.join(command_words[0])
+            text = ' '.join(pieces[n:])
+            self.log.debug(
+                'find_command_handler: match handler=%s, command=%s, text=%s',
+                handler,
+                command,
+                text,
+            )
+            return (command_words, handler, command, text)
+
+        # no match, build the candidate command words so that we can suggest
+        # things that are close
+        processed_pieces = [self.command_trie.normalize(p) for p in pieces]
         n = min(len(processed_pieces), self.command_max_words)
         command_words = [tuple(processed_pieces[0:i]) for i in range(n, 0, -1)]
-        self.log.debug('find_command_handler: command_words=%s', command_words)
-        # look for matching commands
-        for command_word in command_words:
-            try:
-                handler = self.command_words[command_word]
-                # we've found a match
-                command = ' '.join(command_word)
-                n = len(command_word)
-                text = ' '.join(pieces[n:])
-                self.log.debug(
-                    'find_command_handler: match handler=%s, command=%s, text=%s',
-                    handler,
-                    command,
-                    text,
-                )
-                return (command_words, handler, command, text)
-            except KeyError:
-                pass
-
-        self.log.debug('find_command_handler: no match')
+        self.log.debug(
+            'find_command_handler: no match, command_words=%s', command_words
+        )
         return (command_words, None, None, None)
 
     @dispatch_with_error_reporting
@@ -236,8 +333,15 @@ class Dispatcher(object):
         self.log.debug('command: text=%s, kwargs=%s', text, kwargs)
         command_words, handler, command, text = self.find_command_handler(text)
         if handler:
-            handler.command(
-                context, command=command, text=text, dispatcher=self, **kwargs
+            self._call_handler(
+                'command',
+                handler,
+                handler.command,
+                context,
+                command=command,
+                text=text,
+                dispatcher=self,
+                **kwargs,
             )
         else:
             self._did_you_mean(context, command_words)
@@ -249,16 +353,87 @@ class Dispatcher(object):
     @dispatch
     def joined(self, *args, **kwargs):
         for handler in self.joineds:
-            handler.joined(*args, dispatcher=self, **kwargs)
+            self._call_handler(
+                'joined',
+                handler,
+                handler.joined,
+                *args,
+                dispatcher=self,
+                **kwargs,
+            )
 
     @dispatch
     def left(self, *args, **kwargs):
         pprint({'type': 'left', 'args': args, 'kwargs': kwargs})
 
-    @dispatch
+    def _message_handler(self, handler, *args, **kwargs):
+        # each handler is its own unit of work, with its own transaction and
+        # error handling, so that one failing can't take out the others. We're
+        # on a message_executor thread so check our database connection's
+        # health before and after like Cron does.
+        close_old_connections()
+        try:
+            with transaction.atomic():
+                self._call_handler(
+                    'message',
+                    handler,
+                    handler.message,
+                    *args,
+                    dispatcher=self,
+                    **kwargs,
+                )
+        except Exception:
+            self.log.exception(
+                'message: handler failed: handler=%s, args=%s, kwargs=%s',
+                handler,
+                args,
+                kwargs,
+            )
+        finally:
+            close_old_connections()
+
     def message(self, *args, **kwargs):
-        for handler in self.messages:
-            handler.message(*args, dispatcher=self, **kwargs)
+        _instrument(
+            lambda: self._message(*args, **kwargs), (('event', 'message'),)
+        )
+
+    def _message(self, *args, **kwargs):
+        # fan out to all of the handlers concurrently so that we take as long
+        # as the slowest rather than the sum of them all
+        futures = {
+            message_executor.submit(
+                self._message_handler, handler, *args, **kwargs
+            ): handler
+            for handler in self.messages
+        }
+        _, not_done = wait(futures, timeout=self.message_timeout)
+        for future in not_done:
+            handler = futures[future]
+            labels = (('handler', handler.__class__.__name__),)
+            metrics.inc('simone_message_handler_timeouts_total', labels)
+            self.log.warning(
+                'message: handler timed out: handler=%s, timeout=%s',
+                handler,
+                self.message_timeout,
+            )
+            # there's no way to stop a running thread, we just stop waiting on
+            # it, and skip it if it hasn't started yet
+            if future.cancel():
+                continue
+            # it's still holding a message_executor thread, keep track of it
+            # until it lets go
+            metrics.inc('simone_message_handlers_abandoned', labels)
+            future.add_done_callback(
+                partial(self._abandoned_done, handler, labels, perf_counter())
+            )
+
+    def _abandoned_done(self, handler, labels, start, future):
+        metrics.inc('simone_message_handlers_abandoned', labels, -1)
+        self.log.warning(
+            'message: abandoned handler finished: handler=%s, overran=%.3f',
+            handler,
+            perf_counter() - start,
+        )
 
     @dispatch
     def removed(self, *args, **kwargs):
@@ -298,8 +473,30 @@ class Dispatcher(object):
 
         return cron
 
+    def _start(self):
+        # handlers that want to get going before their first event, e.g.
+        # warming caches, are started on the first tick so that it happens
+        # in each worker, after any forking
+        self._started = True
+        for handler in self.starts:
+            try:
+                self._call_handler(
+                    'start', handler, handler.start, dispatcher=self
+                )
+            except Exception:
+                self.log.exception('_start: handler=%s failed', handler)
+
     def tick(self, now):
         self.log.debug('tick: ')
+        if not self._started:
+            self._start()
+        for name, listener in sorted(self.listeners.items()):
+            # listeners get a chance to do their own housekeeping, a failure
+            # shouldn't keep the handler crons from running
+            try:
+                listener.tick(now)
+            except Exception:
+                self.log.exception('tick: listener=%s failed', name)
         # we've validated things during init so we can just use them here
         for cron, handler in self.crons:
             self.log.debug('tick:   cron=%s, handler=%s', cron, handler)
@@ -318,7 +515,14 @@ class Dispatcher(object):
                 )
                 continue
             context = listener.context(channel=channel)
-            handler.cron(context, cron=cron, dispatcher=self)
+            self._call_handler(
+                'cron',
+                handler,
+                handler.cron,
+                context,
+                cron=cron,
+                dispatcher=self,
+            )
 
 
 class Cron(Thread):
@@ -1,10 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
 from django.utils.module_loading import autodiscover_modules
 from functools import partial, wraps
 from logging import getLogger
+from time import time
 
 from requests import Session
 
 from .context import ChannelType
+from .metrics import metrics
+
+metrics.describe(
+    'simone_executor_queued', 'gauge', 'Work waiting for an executor thread'
+)
+metrics.describe(
+    'simone_executor_active', 'gauge', 'Work running on an executor thread'
+)
 
 
 def only_channel_types(_func=None, channel_types={ChannelType.PUBLIC}):
@@ -74,9 +88,136 @@ class _Registry(object):
 
 Registry = _Registry()
 
+
+class _Generations(object):
+    '''
+    Cross-process invalidation for handler caches.
+
+    Handlers bump a named generation whenever they change the data behind a
+    cache and ask whether it's stale before using it. Checking is a single
+    indexed read and happens at most once every interval seconds per name so
+    other workers will see changes within that window.
+
+    model is the app_label.ModelName of where generations are stored, looked
+    up on use so that simone doesn't depend on the app that provides it. It
+    needs a unique name and an integer generation.
+    '''
+
+    log = getLogger('Generations')
+
+    def __init__(self, interval, model='handler.Generation'):
+        self.interval = interval
+        self.model_name = model
+        self._known = {}
+        self._checked = {}
+
+    @property
+    def model(self):
+        return apps.get_model(self.model_name)
+
+    def _current(self, name):
+        return (
+            self.model.objects.filter(name=name)
+            .values_list('generation', flat=True)
+            .first()
+        ) or 0
+
+    def bump(self, name):
+        updated = self.model.objects.filter(name=name).update(
+            generation=F('generation') + 1
+        )
+        if not updated:
+            try:
+                with transaction.atomic():
+                    self.model.objects.create(name=name, generation=1)
+            except IntegrityError:
+                # someone else beat us to creating it
+                self.model.objects.filter(name=name).update(
+                    generation=F('generation') + 1
+                )
+        # we already know about our own change, the caller will have
+        # invalidated its cache
+        self._known[name] = self._current(name)
+        self._checked[name] = time()
+        self.log.debug('bump: name=%s, generation=%d', name, self._known[name])
+
+    def stale(self, name):
+        '''
+        Returns True if the cache for name should be rebuilt, either because
+        another process has bumped it or we've not checked before.
+        '''
+        now = time()
+        if now - self._checked.get(name, 0) < self.interval:
+            return False
+        self._checked[name] = now
+        current = self._current(name)
+        previous = self._known.get(name, None)
+        self._known[name] = current
+        if previous != current:
+            self.log.debug(
+                'stale: name=%s, previous=%s, current=%d',
+                name,
+                previous,
+                current,
+            )
+            return True
+        return False
+
+
+class InstrumentedExecutor(ThreadPoolExecutor):
+    '''
+    ThreadPoolExecutor that keeps gauges of how much of its work is waiting
+    for a thread and how much is running, labeled with name, so that its
+    saturation shows up in metrics.
+    '''
+
+    def __init__(self, name, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._labels = (('executor', name),)
+        # make sure they're reported before there's been any work
+        metrics.inc('simone_executor_queued', self._labels, 0)
+        metrics.inc('simone_executor_active', self._labels, 0)
+
+    def _run(self, fn, args, kwargs):
+        metrics.inc('simone_executor_queued', self._labels, -1)
+        metrics.inc('simone_executor_active', self._labels)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            metrics.inc('simone_executor_active', self._labels, -1)
+
+    def _done(self, future):
+        if future.cancelled():
+            # never made it to _run
+            metrics.inc('simone_executor_queued', self._labels, -1)
+
+    def submit(self, fn, *args, **kwargs):
+        metrics.inc('simone_executor_queued', self._labels)
+        try:
+            future = super().submit(self._run, fn, args, kwargs)
+        except Exception:
+            metrics.inc('simone_executor_queued', self._labels, -1)
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+
+generations = _Generations(
+    getattr(settings, 'CACHE_GENERATION_INTERVAL', 30),
+    model=getattr(settings, 'CACHE_GENERATION_MODEL', 'handler.Generation'),
+)
+
 # A shared requests session that can be used by all handlers to get best
 # practices w/o having to deal with the details
 session = Session()
 session.headers = {'user-agent': 'simone/0.0'}
 # shim an default timeout
 session.request = partial(session.request, timeout=5)
+
+# A shared, bounded pool for handlers' outbound requests so that slow
+# third-parties queue up rather than each handler growing its own threads,
+# its saturation is reported like the dispatcher's pools
+max_outbound = getattr(settings, 'MAX_OUTBOUND_WORKERS', 8)
+outbound_executor = InstrumentedExecutor(
+    'outbound', max_workers=max_outbound, thread_name_prefix='simone-outbound'
+)
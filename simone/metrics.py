@@ -0,0 +1,141 @@
+from bisect import bisect_left
+from io import StringIO
+from threading import Lock, local
+
+
+class Metrics(object):
+    '''
+    Counters, gauges and histograms exposed in the Prometheus text format.
+
+    Writes go to a shard owned by the current thread so the hot path never
+    takes a lock, shards are summed up when render is called by a scrape.
+    Callback gauges are evaluated at render time for things like queue depths
+    that are cheaper to read than to track.
+    '''
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+
+        self._help = {}
+        self._types = {}
+        self._callbacks = {}
+        self._local = local()
+        self._shards = []
+        self._lock = Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            pass
+        # first write from this thread, only time we need the lock
+        shard = {'counters': {}, 'histograms': {}}
+        with self._lock:
+            self._shards.append(shard)
+        self._local.shard = shard
+        return shard
+
+    def describe(self, name, metric_type, help_text):
+        self._types[name] = metric_type
+        self._help[name] = help_text
+
+    def gauge_callback(self, name, func, help_text=''):
+        '''
+        func should return a list of (labels, value) tuples. Registering the
+        same name again replaces the previous callback.
+        '''
+        self.describe(name, 'gauge', help_text)
+        self._callbacks[name] = func
+
+    def inc(self, name, labels=(), value=1):
+        '''
+        labels is a tuple of (label, value) pairs. inc'ing by a negative value
+        turns a counter into a gauge, e.g. for tracking in-flight work.
+        '''
+        counters = self._shard()['counters']
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        histograms = self._shard()['histograms']
+        key = (name, labels)
+        try:
+            histogram = histograms[key]
+        except KeyError:
+            # a count per bucket, the last is +Inf, then sum
+            histogram = histograms[key] = [0] * (len(self.buckets) + 2)
+        histogram[bisect_left(self.buckets, value)] += 1
+        histogram[-1] += value
+
+    def _aggregate(self):
+        with self._lock:
+            shards = list(self._shards)
+        counters = {}
+        histograms = {}
+        for shard in shards:
+            # copies are atomic so the owning thread can keep on writing
+            for key, value in shard['counters'].copy().items():
+                counters[key] = counters.get(key, 0) + value
+            for key, histogram in shard['histograms'].copy().items():
+                histogram = list(histogram)
+                try:
+                    total = histograms[key]
+                    for i, value in enumerate(histogram):
+                        total[i] += value
+                except KeyError:
+                    histograms[key] = histogram
+        return counters, histograms
+
+    def _escape(self, value):
+        return (
+            str(value)
+            .replace('\\', '\\\\')
+            .replace('"', '\\"')
+            .replace('\n', '\\n')
+        )
+
+    def _labels(self, labels):
+        if not labels:
+            return ''
+        labels = ','.join(f'{k}="{self._escape(v)}"' for k, v in labels)
+        return f'{{{labels}}}'
+
+    def _header(self, buf, name, seen):
+        if name in seen:
+            return
+        seen.add(name)
+        help_text = self._help.get(name, None)
+        if help_text:
+            buf.write(f'# HELP {name} {help_text}\n')
+        buf.write(f'# TYPE {name} {self._types.get(name, "untyped")}\n')
+
+    def render(self):
+        counters, histograms = self._aggregate()
+        buf = StringIO()
+        seen = set()
+
+        for (name, labels), value in sorted(counters.items()):
+            self._header(buf, name, seen)
+            buf.write(f'{name}{self._labels(labels)} {value}\n')
+
+        for (name, labels), histogram in sorted(histograms.items()):
+            self._header(buf, name, seen)
+            cumulative = 0
+            for le, value in zip(self.buckets + ('+Inf',), histogram):
+                cumulative += value
+                bucket_labels = self._labels(labels + (('le', le),))
+                buf.write(f'{name}_bucket{bucket_labels} {cumulative}\n')
+            buf.write(f'{name}_sum{self._labels(labels)} {histogram[-1]}\n')
+            buf.write(f'{name}_count{self._labels(labels)} {cumulative}\n')
+
+        for name, func in sorted(self._callbacks.items()):
+            self._header(buf, name, seen)
+            for labels, value in func():
+                buf.write(f'{name}{self._labels(labels)} {value}\n')
+
+        return buf.getvalue()
+
+
+metrics = Metrics()
@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from heapq import heappop, heappush
+from itertools import count
+from logging import getLogger
+from threading import Condition, Thread
+from time import monotonic
+
+
+class Scheduler(object):
+    '''
+    Runs functions at a later time without tying up a thread per pending
+    call.
+
+    A single timer thread sleeps until the earliest due entry and then hands
+    it off to executor to run so that slow functions can't delay others.
+    '''
+
+    log = getLogger('Scheduler')
+
+    def __init__(self, executor):
+        self.executor = executor
+
+        self._heap = []
+        # tie breaker so that entries due at the same time run in the order
+        # they were scheduled and we never compare funcs
+        self._seq = count()
+        self._condition = Condition()
+        self._thread = None
+
+    @property
+    def pending(self):
+        return len(self._heap)
+
+    def _start(self):
+        # must be called with the condition held. Started on demand so that
+        # nothing is running until there's something to do, e.g. after
+        # gunicorn has forked
+        if self._thread is None:
+            self._thread = Thread(
+                target=self._run, name='simone-scheduler', daemon=True
+            )
+            self._thread.start()
+
+    def schedule(self, delay, func, *args, **kwargs):
+        due = monotonic() + max(delay, 0)
+        with self._condition:
+            self._start()
+            heappush(self._heap, (due, next(self._seq), func, args, kwargs))
+            # wake the timer thread in case this is now the earliest entry
+            self._condition.notify()
+
+    def _call(self, func, args, kwargs):
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            self.log.exception(
+                '_call: failed func=%s, args=%s, kwargs=%s', func, args, kwargs
+            )
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    timeout = self._heap[0][0] - monotonic()
+                    if timeout <= 0:
+                        break
+                    self._condition.wait(timeout=timeout)
+                _, _, func, args, kwargs = heappop(self._heap)
+            self.executor.submit(self._call, func, args, kwargs)
+
+
+max_scheduled = getattr(settings, 'MAX_SCHEDULED_WORKERS', 4)
+scheduler = Scheduler(
+    ThreadPoolExecutor(
+        max_workers=max_scheduled, thread_name_prefix='simone-scheduled'
+    )
+)
@@ -0,0 +1,357 @@
+from datetime import datetime
+from django.test import TestCase
+from mock import MagicMock
+from pylev import levenshtein
+from threading import Event, Thread
+from time import monotonic, sleep
+
+from .commands import BKTree, CommandTrie
+from .context import BaseContext, ChannelType
+from .dispatcher import Dispatcher
+from .handlers import InstrumentedExecutor
+from .metrics import Metrics, metrics
+from .scheduler import Scheduler
+
+
+class DummyHandler(object):
+    def __init__(self, commands=(), messages=False):
+        self.commands = commands
+        self.messages = messages
+
+    def config(self):
+        return {'commands': self.commands, 'messages': self.messages}
+
+
+class MessageHandler(DummyHandler):
+    def __init__(self, error=False, block=None):
+        super().__init__(messages=True)
+        self.error = error
+        self.block = block
+        self.calls = []
+
+    def message(self, context, text, dispatcher, **kwargs):
+        if self.block:
+            self.block.wait()
+        if self.error:
+            raise Exception('boom')
+        self.calls.append(text)
+
+
+class RecordingContext(BaseContext):
+    def __init__(self, expected):
+        super().__init__(
+            'C42', 'general', ChannelType.PUBLIC, '1633815504.005800', 'U42'
+        )
+        self.expected = expected
+        self.said = []
+        self.done = Event()
+
+    def say(self, text, **kwargs):
+        self.said.append((text, kwargs, monotonic()))
+        if len(self.said) == self.expected:
+            self.done.set()
+
+
+class TestCommandTrie(TestCase):
+    def test_longest_prefix(self):
+        trie = CommandTrie('<@user-id>', '<#channel-id>')
+        trie.add(('image',), 'image')
+        trie.add(('image', 'bomb'), 'image bomb')
+        trie.add(('tell', 'me', 'a', 'joke'), 'joke')
+
+        self.assertEqual(('image', 1), trie.match(['image', 'cats']))
+        self.assertEqual(
+            ('image bomb', 2), trie.match(['image', 'bomb', 'cats'])
+        )
+        self.assertEqual(('joke', 4), trie.match(['tell', 'me', 'a', 'joke']))
+        # partial paths that don't terminate in a command don't match
+        self.assertEqual((None, 0), trie.match(['tell', 'me', 'a']))
+        self.assertEqual((None, 0), trie.match(['nope']))
+        self.assertEqual((None, 0), trie.match([]))
+
+    def test_placeholders(self):
+        trie = CommandTrie('<@user-id>', '<#channel-id>')
+        trie.add(('<@user-id>', 'is'), 'is')
+        trie.add(('<@user-id>', 'is', 'not'), 'is not')
+        trie.add(('in', '<#channel-id>'), 'in')
+
+        self.assertEqual(('is', 2), trie.match(['<@U42>', 'is', 'cool']))
+        self.assertEqual(
+            ('is not', 3), trie.match(['<@U42>', 'is', 'not', 'cool'])
+        )
+        self.assertEqual(('in', 2), trie.match(['in', '<#C42|general>']))
+
+
+class TestBKTree(TestCase):
+    def test_search(self):
+        values = ('help', 'holidays', 'joke', 'pun', 'quote', 'rem', 'when')
+        tree = BKTree(levenshtein, values)
+        # adding a duplicate is a noop
+        tree.add('joke')
+
+        self.assertEqual([(0, 'joke')], tree.search('joke', 0))
+        self.assertEqual([(1, 'joke')], tree.search('joka', 1))
+        for radius in range(6):
+            self.assertEqual(
+                sorted(
+                    (levenshtein('quoted', v), v)
+                    for v in values
+                    if levenshtein('quoted', v) <= radius
+                ),
+                sorted(tree.search('quoted', radius)),
+            )
+
+        self.assertEqual([], BKTree(levenshtein).search('anything', 3))
+
+
+class TestDispatcher(TestCase):
+    def test_find_command_handler(self):
+        about = DummyHandler(commands=('who is', '<@user-id> is'))
+        image = DummyHandler(commands=('image', 'image bomb'))
+        dispatcher = Dispatcher([about, image])
+
+        command_words, handler, command, text = dispatcher.find_command_handler(
+            '  image bomb   kittens  '
+        )
+        self.assertEqual(image, handler)
+        self.assertEqual('image bomb', command)
+        self.assertEqual('kittens', text)
+
+        command_words, handler, command, text = dispatcher.find_command_handler(
+            '<@U42> is a good human'
+        )
+        self.assertEqual(about, handler)
+        self.assertEqual('<@user-id> is', command)
+        self.assertEqual('a good human', text)
+
+        command_words, handler, command, text = dispatcher.find_command_handler(
+            'who are <@U42>'
+        )
+        self.assertIsNone(handler)
+        self.assertIsNone(command)
+        self.assertIsNone(text)
+        self.assertEqual([('who', 'are'), ('who',)], command_words)
+
+    def test_did_you_mean(self):
+        image = DummyHandler(commands=('image', 'image bomb', 'joke'))
+        dispatcher = Dispatcher([image])
+        context = MagicMock()
+
+        command_words, _, _, _ = dispatcher.find_command_handler('imagr bomb')
+        dispatcher._did_you_mean(context, command_words)
+        context.say.assert_called_once_with(
+            "Sorry `imagr` is not a recognized command. Maybe you're looking "
+            "for `.image` or `.image bomb`."
+        )
+
+        # nothing close, nothing said
+        context.reset_mock()
+        command_words, _, _, _ = dispatcher.find_command_handler('zzzzzz')
+        dispatcher._did_you_mean(context, command_words)
+        context.say.assert_not_called()
+
+    def test_message_isolation(self):
+        first = MessageHandler()
+        failing = MessageHandler(error=True)
+        last = MessageHandler()
+        dispatcher = Dispatcher([first, failing, last])
+
+        dispatcher.message(context=None, text='hello')
+        # a failing handler doesn't keep the others from running
+        self.assertEqual(['hello'], first.calls)
+        self.assertEqual(['hello'], last.calls)
+
+    def test_message_timeout(self):
+        block = Event()
+        slow = MessageHandler(block=block)
+        fast = MessageHandler()
+        dispatcher = Dispatcher([slow, fast])
+        dispatcher.message_timeout = 0.05
+
+        gauge = 'simone_message_handlers_abandoned{handler="MessageHandler"}'
+        try:
+            dispatcher.message(context=None, text='hello')
+            # we gave up on the slow one, but the fast one finished
+            self.assertEqual([], slow.calls)
+            self.assertEqual(['hello'], fast.calls)
+            # and it's counted until it finishes
+            self.assertIn(f'{gauge} 1', metrics.render())
+        finally:
+            block.set()
+        deadline = monotonic() + 5
+        while f'{gauge} 0' not in metrics.render() and monotonic() < deadline:
+            sleep(0.01)
+        self.assertIn(f'{gauge} 0', metrics.render())
+        self.assertIn(
+            'simone_message_handler_timeouts_total{handler="MessageHandler"}',
+            metrics.render(),
+        )
+
+
+class StartHandler(DummyHandler):
+    def __init__(self, error=False):
+        super().__init__()
+        self.error = error
+        self.starts = 0
+
+    def config(self):
+        return {'start': True}
+
+    def start(self, dispatcher):
+        self.starts += 1
+        if self.error:
+            raise Exception('boom')
+
+
+class TestStart(TestCase):
+    def test_first_tick(self):
+        failing = StartHandler(error=True)
+        handler = StartHandler()
+        dispatcher = Dispatcher([failing, handler, DummyHandler()])
+        self.assertEqual(0, handler.starts)
+        # started on the first tick, one failing doesn't stop the others,
+        # and only the once
+        dispatcher.tick(datetime(2021, 10, 20, 12, 0))
+        dispatcher.tick(datetime(2021, 10, 20, 12, 1))
+        self.assertEqual(1, failing.starts)
+        self.assertEqual(1, handler.starts)
+
+
+class TestInstrumentedExecutor(TestCase):
+    def test_gauges(self):
+        executor = InstrumentedExecutor('test', max_workers=1)
+        active = 'simone_executor_active{executor="test"}'
+        queued = 'simone_executor_queued{executor="test"}'
+        self.assertIn(f'{queued} 0', metrics.render())
+
+        started = Event()
+        block = Event()
+
+        def slow():
+            started.set()
+            block.wait()
+
+        executor.submit(slow)
+        self.assertTrue(started.wait(5))
+        executor.submit(lambda: None)
+        cancelled = executor.submit(lambda: None)
+        content = metrics.render()
+        self.assertIn(f'{active} 1', content)
+        self.assertIn(f'{queued} 2', content)
+
+        # cancelling takes it out of the queue
+        cancelled.cancel()
+        self.assertIn(f'{queued} 1', metrics.render())
+
+        block.set()
+        executor.shutdown(wait=True)
+        content = metrics.render()
+        self.assertIn(f'{active} 0', content)
+        self.assertIn(f'{queued} 0', content)
+
+
+class TestScheduler(TestCase):
+    def test_converse(self):
+        context = RecordingContext(expected=3)
+        start = monotonic()
+        context.converse(('one', 'two', 'three'), pauses=(0.05, 0), reply=True)
+        # the first is sent right away and we don't wait for the rest
+        self.assertEqual(
+            [('one', {'reply': True})], [s[:2] for s in context.said]
+        )
+
+        self.assertTrue(context.done.wait(timeout=5))
+        self.assertEqual(['one', 'two', 'three'], [s[0] for s in context.said])
+        self.assertEqual([{'reply': True}] * 3, [s[1] for s in context.said])
+        self.assertGreaterEqual(context.said[1][2] - start, 0.05)
+
+    def test_schedule(self):
+        ran = []
+        done = Event()
+
+        class Inline(object):
+            def submit(self, func, *args):
+                func(*args)
+
+        def record(value):
+            ran.append(value)
+            if value == 'boom':
+                raise Exception(value)
+            if len(ran) == 4:
+                done.set()
+
+        scheduler = Scheduler(Inline())
+        scheduler.schedule(0.1, record, 'last')
+        scheduler.schedule(0, record, 'first')
+        # failures are logged and don't stop the scheduler
+        scheduler.schedule(0.02, record, 'boom')
+        scheduler.schedule(0.02, record, 'second')
+        self.assertTrue(done.wait(timeout=5))
+        self.assertEqual(['first', 'boom', 'second', 'last'], ran)
+        self.assertEqual(0, scheduler.pending)
+
+
+class TestMetrics(TestCase):
+    def test_render(self):
+        metrics = Metrics(buckets=(0.1, 1))
+        metrics.describe('requests_total', 'counter', 'Requests')
+        metrics.describe('latency_seconds', 'histogram', 'Latency')
+        metrics.inc('requests_total', (('path', 'a"b'),))
+        metrics.inc('requests_total', (('path', 'a"b'),), 2)
+        metrics.observe('latency_seconds', 0.05)
+        metrics.observe('latency_seconds', 0.5)
+        metrics.observe('latency_seconds', 5)
+
+        # writes from another thread land in their own shard
+        done = Event()
+
+        def other():
+            metrics.inc('requests_total', (('path', 'a"b'),))
+            done.set()
+
+        Thread(target=other).start()
+        self.assertTrue(done.wait(timeout=5))
+
+        metrics.gauge_callback('depth', lambda: [((('q', 'x'),), 42)], 'Depth')
+
+        self.assertEqual(
+            """# HELP requests_total Requests
+# TYPE requests_total counter
+requests_total{path="a\\"b"} 4
+# HELP latency_seconds Latency
+# TYPE latency_seconds histogram
+latency_seconds_bucket{le="0.1"} 1
+latency_seconds_bucket{le="1"} 2
+latency_seconds_bucket{le="+Inf"} 3
+latency_seconds_sum 5.55
+latency_seconds_count 3
+# HELP depth Depth
+# TYPE depth gauge
+depth{q="x"} 42
+""",
+            metrics.render(),
+        )
+
+    def test_endpoint(self):
+        dispatcher = Dispatcher([MessageHandler(error=True)])
+        dispatcher.message(context=None, text='hello')
+
+        resp = self.client.get('/metrics')
+        self.assertEqual(200, resp.status_code)
+        content = resp.content.decode('utf-8')
+        self.assertIn(
+            'simone_handler_errors_total{event="message",handler="MessageHandler"}',
+            content,
+        )
+        self.assertIn('simone_dispatch_seconds_count{event="message"}', content)
+        self.assertIn('simone_dispatch_in_flight{event="message"} 0', content)
+        self.assertIn(
+            'simone_handler_in_flight{event="message",handler="MessageHandler"} 0',
+            content,
+        )
+        self.assertIn(
+            'simone_executor_max_threads{executor="worker"} 10', content
+        )
+        self.assertIn('simone_executor_active{executor="message"} 0', content)
+        self.assertIn('simone_executor_queued{executor="worker"}', content)
+        self.assertIn('simone_executor_queued{executor="outbound"}', content)
@@ -0,0 +1,9 @@
+from django.http import HttpResponse
+
+from .metrics import metrics
+
+
+def metrics_view(request):
+    return HttpResponse(
+        metrics.render(), content_type='text/plain; version=0.0.4'
+    )
@@ -0,0 +1,81 @@
+from logging import getLogger
+from threading import Lock
+from time import time
+
+from .models import Channel
+
+
+class ChannelCache(object):
+    '''
+    Process-local cache of Channel rows by id and by name.
+
+    Entries expire after ttl seconds at which point they'll be re-read from
+    the database. The full table is loaded the first time the cache is used,
+    rather than at construction, since things like the initial migration need
+    to run before the table exists.
+    '''
+
+    log = getLogger('ChannelCache')
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+
+        self._by_id = {}
+        self._by_name = {}
+        self._lock = Lock()
+        self._warmed = False
+
+    def warm(self):
+        channels = list(Channel.objects.all())
+        with self._lock:
+            self._by_id.clear()
+            self._by_name.clear()
+            for channel in channels:
+                self._put(channel)
+            self._warmed = True
+        self.log.info('warm: channels=%d', len(channels))
+
+    def _put(self, channel):
+        # must be called with the lock held
+        expires = time() + self.ttl
+        previous = self._by_id.get(channel.id, None)
+        if previous is not None and previous[0].name != channel.name:
+            # renamed, the old name no longer points here
+            self._by_name.pop(previous[0].name, None)
+        self._by_id[channel.id] = (channel, expires)
+        self._by_name[channel.name] = (channel, expires)
+
+    def put(self, channel):
+        with self._lock:
+            self._put(channel)
+
+    def _get(self, entries, key):
+        if not self._warmed:
+            self.warm()
+        try:
+            channel, expires = entries[key]
+            if expires > time():
+                return channel
+        except KeyError:
+            pass
+        return None
+
+    def get(self, channel_id):
+        channel = self._get(self._by_id, channel_id)
+        if channel is None:
+            try:
+                channel = Channel.objects.get(id=channel_id)
+            except Channel.DoesNotExist:
+                return None
+            self.put(channel)
+        return channel
+
+    def get_by_name(self, channel_name):
+        channel = self._get(self._by_name, channel_name)
+        if channel is None:
+            try:
+                channel = Channel.objects.get(name=channel_name)
+            except Channel.DoesNotExist:
+                return None
+            self.put(channel)
+        return channel
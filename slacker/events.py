@@ -0,0 +1,264 @@
+from collections import OrderedDict
+from datetime import timedelta
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+from logging import getLogger
+from queue import Full, Queue
+from threading import Lock, Thread
+from time import time
+
+from simone.metrics import metrics
+from .models import SeenEvent
+
+metrics.describe(
+    'simone_slack_event_cache_total',
+    'counter',
+    'Event cache lookups by result, hit (duplicate) or miss',
+)
+metrics.describe(
+    'simone_slack_event_retries_total',
+    'counter',
+    'Events that arrived with a X-Slack-Retry-Num',
+)
+
+
+class EventQueue(object):
+    '''
+    Bounded in-process queue of Slack events with a pool of consumer threads
+    pulling from it so that listeners can return, and Slack be acked,
+    immediately.
+
+    when_full controls what happens when the queue is full:
+        - block: wait for space, Slack's retries become our backpressure
+        - drop: throw the event away
+        - shed: throw away low priority events, wait for space for others
+    '''
+
+    BLOCK = 'block'
+    DROP = 'drop'
+    SHED = 'shed'
+
+    log = getLogger('EventQueue')
+
+    def __init__(self, process, maxsize=100, consumers=4, when_full=SHED):
+        if when_full not in (self.BLOCK, self.DROP, self.SHED):
+            raise ValueError(f'unrecognized when_full={when_full}')
+        self.log.info(
+            '__init__: maxsize=%d, consumers=%d, when_full=%s',
+            maxsize,
+            consumers,
+            when_full,
+        )
+        self.process = process
+        self.consumers = consumers
+        self.when_full = when_full
+
+        self.dropped = 0
+
+        self._queue = Queue(maxsize=maxsize)
+        self._lock = Lock()
+        self._threads = None
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def start(self):
+        # consumers are started on demand so that nothing is running until
+        # there are events to process, e.g. during migrations and tests
+        with self._lock:
+            if self._threads is not None:
+                return
+            self._threads = []
+            for i in range(self.consumers):
+                thread = Thread(
+                    target=self._consume, name=f'simone-event-{i}', daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def put(self, kind, event, low_priority=False):
+        '''
+        Returns True if the event was queued, False if it was dropped.
+        '''
+        self.start()
+        if self.when_full == self.BLOCK or (
+            self.when_full == self.SHED and not low_priority
+        ):
+            self._queue.put((kind, event))
+            return True
+        try:
+            self._queue.put_nowait((kind, event))
+            return True
+        except Full:
+            # producers are Slack's request threads, more than one can be
+            # dropping at once
+            with self._lock:
+                self.dropped += 1
+                dropped = self.dropped
+            self.log.warning(
+                'put: queue full, dropping kind=%s, low_priority=%s, dropped=%d',
+                kind,
+                low_priority,
+                dropped,
+            )
+            return False
+
+    def _consume(self):
+        while True:
+            kind, event = self._queue.get()
+            # we're in our own thread so check our database connection's
+            # health before and after like Cron does
+            close_old_connections()
+            try:
+                self.process(kind, event)
+            except Exception:
+                self.log.exception(
+                    '_consume: process failed, kind=%s, event=%s', kind, event
+                )
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+    def join(self):
+        self._queue.join()
+
+
+class _EventCache(object):
+    '''
+    Remembers recently seen Slack event ids so that redeliveries aren't
+    dispatched a second time.
+
+    hits counts duplicates that were skipped, misses new events, and retries
+    the events that arrived with a X-Slack-Retry-Num, whether or not we'd seen
+    them.
+    '''
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.retries = 0
+        self._counts_lock = Lock()
+
+    def _seen(self, event_id):
+        '''
+        Records event_id returning True if it had already been recorded.
+        '''
+        raise NotImplementedError('_seen is not implemented')
+
+    def forget(self, event_id):
+        '''
+        Removes event_id, e.g. when it couldn't be processed, so that a
+        redelivery won't be treated as a duplicate.
+        '''
+        raise NotImplementedError('forget is not implemented')
+
+    def duplicate(self, event_id, retry_num=0):
+        if retry_num:
+            with self._counts_lock:
+                self.retries += 1
+            metrics.inc('simone_slack_event_retries_total')
+        if self._seen(event_id):
+            with self._counts_lock:
+                self.hits += 1
+            metrics.inc('simone_slack_event_cache_total', (('result', 'hit'),))
+            self.log.info(
+                'duplicate: event_id=%s, retry_num=%d, hits=%d, misses=%d, retries=%d',
+                event_id,
+                retry_num,
+                self.hits,
+                self.misses,
+                self.retries,
+            )
+            return True
+        with self._counts_lock:
+            self.misses += 1
+        metrics.inc('simone_slack_event_cache_total', (('result', 'miss'),))
+        return False
+
+    def stats(self):
+        with self._counts_lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'retries': self.retries,
+            }
+
+
+class MemoryEventCache(_EventCache):
+    '''
+    Process-local cache, bounded by both size and ttl.
+    '''
+
+    log = getLogger('MemoryEventCache')
+
+    def __init__(self, ttl=600, maxsize=10000):
+        super().__init__(ttl)
+        self.maxsize = maxsize
+
+        self._expirations = OrderedDict()
+        self._lock = Lock()
+
+    def _seen(self, event_id):
+        now = time()
+        with self._lock:
+            # entries are in insertion order and share a ttl so the expired
+            # ones are all at the front
+            expirations = self._expirations
+            while expirations:
+                oldest, expires = next(iter(expirations.items()))
+                if expires > now:
+                    break
+                del expirations[oldest]
+
+            if event_id in expirations:
+                return True
+
+            expirations[event_id] = now + self.ttl
+            if len(expirations) > self.maxsize:
+                expirations.popitem(last=False)
+            return False
+
+    def forget(self, event_id):
+        with self._lock:
+            self._expirations.pop(event_id, None)
+
+
+class DatabaseEventCache(_EventCache):
+    '''
+    Cache backed by the SeenEvent table so that it's shared by all workers.
+    Expired rows are purged at most once per purge_interval seconds.
+    '''
+
+    log = getLogger('DatabaseEventCache')
+
+    def __init__(self, ttl=600, purge_interval=60):
+        super().__init__(ttl)
+        self.purge_interval = purge_interval
+
+        self._last_purge = 0
+
+    def _purge(self):
+        now = time()
+        if now - self._last_purge < self.purge_interval:
+            return
+        self._last_purge = now
+        cutoff = timezone.now() - timedelta(seconds=self.ttl)
+        deleted, _ = SeenEvent.objects.filter(created_at__lt=cutoff).delete()
+        self.log.debug('_purge: deleted=%d', deleted)
+
+    def _seen(self, event_id):
+        self._purge()
+        try:
+            # the primary key makes this an atomic check and set across
+            # workers
+            with transaction.atomic():
+                SeenEvent.objects.create(event_id=event_id)
+            return False
+        except IntegrityError:
+            return True
+
+    def forget(self, event_id):
+        SeenEvent.objects.filter(event_id=event_id).delete()
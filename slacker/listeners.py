@@ -1,3 +1,6 @@
+from cron_validator import CronValidator
+from django.conf import settings
+from django.db import connection
 from django.http import HttpRequest
 from django.views.decorators.csrf import csrf_exempt
 from django.urls import path
@@ -6,13 +9,22 @@ from slack_bolt.adapter.django import SlackRequestHandler
 import re
 
 from simone.context import BaseContext, ChannelType, SenderType
+from simone.metrics import metrics
+from .channels import ChannelCache
+from .events import DatabaseEventCache, EventQueue, MemoryEventCache
 from .models import Channel
+from .ratelimit import RateLimiter
 
 
 class SlackException(Exception):
     pass
 
 
+# Shared by all contexts so that every outbound call is counted against the
+# same buckets
+limiter = RateLimiter(limits=getattr(settings, 'SLACK_RATE_LIMITS', {}))
+
+
 class SlackContext(BaseContext):
     log = getLogger('SlackContext')
 
@@ -35,7 +47,10 @@ class SlackContext(BaseContext):
     def say(self, text, reply=False, to_user=False):
         self.log.debug('say: text=%s, reply=%s', text, reply)
         if to_user:
-            self.app.client.chat_postEphemeral(
+            limiter.call(
+                'chat.postEphemeral',
+                self.channel_id,
+                self.app.client.chat_postEphemeral,
                 channel=self.channel_id,
                 text=text,
                 thread_ts=self.thread,
@@ -51,13 +66,23 @@ class SlackContext(BaseContext):
             thread = self.timestamp
         else:
             thread = None
-        self.app.client.chat_postMessage(
-            channel=self.channel_id, text=text, thread_ts=thread
+        limiter.call(
+            'chat.postMessage',
+            self.channel_id,
+            self.app.client.chat_postMessage,
+            channel=self.channel_id,
+            text=text,
+            thread_ts=thread,
         )
 
     def react(self, emoji):
-        self.app.client.reactions_add(
-            channel=self.channel_id, name=emoji, timestamp=self.timestamp
+        limiter.call(
+            'reactions.add',
+            self.channel_id,
+            self.app.client.reactions_add,
+            channel=self.channel_id,
+            name=emoji,
+            timestamp=self.timestamp,
         )
 
     def user_mention(self, user_id):
@@ -75,6 +100,14 @@ class SlackListener(object):
         'group': Channel.Type.PRIVATE,
         'im': Channel.Type.DIRECT,
     }
+    # the event kinds that are handed to the queue, each is processed by the
+    # method of the same name
+    _PROCESSORS = {
+        'channel_rename',
+        'member_joined_channel',
+        'member_left_channel',
+        'message',
+    }
 
     log = getLogger('SlackListener')
 
@@ -86,24 +119,115 @@ class SlackListener(object):
         self._auth_info = None
         self._bot_mention = None
 
+        self.channels = ChannelCache(
+            ttl=getattr(settings, 'SLACK_CHANNEL_CACHE_TTL', 300)
+        )
+        # optionally sync all channels when Cron starts up and/or on a
+        # schedule so that we know about them before their first message
+        self.sync_channels_on_start = getattr(
+            settings, 'SLACK_SYNC_CHANNELS_ON_START', False
+        )
+        self.sync_channels_when = getattr(
+            settings, 'SLACK_SYNC_CHANNELS_WHEN', None
+        )
+        self._synced_channels = False
+
+        # events are parsed and dispatched by a pool of consumers so that the
+        # listeners can return, and bolt ack, right away
+        self.events = EventQueue(
+            self._process,
+            maxsize=getattr(settings, 'SLACK_EVENT_QUEUE_SIZE', 100),
+            consumers=getattr(settings, 'SLACK_EVENT_CONSUMERS', 4),
+            when_full=getattr(
+                settings, 'SLACK_EVENT_QUEUE_FULL', EventQueue.SHED
+            ),
+        )
+        metrics.gauge_callback(
+            'simone_slack_event_queue_depth',
+            lambda: [((), self.events.depth)],
+            'Slack events waiting for a consumer',
+        )
+        metrics.gauge_callback(
+            'simone_slack_events_dropped',
+            lambda: [((), self.events.dropped)],
+            'Slack events thrown away because the queue was full',
+        )
+
+        # redeliveries of events we've already seen are skipped, either per
+        # process (memory) or shared by all workers (db)
+        event_cache = getattr(settings, 'SLACK_EVENT_CACHE', 'memory')
+        event_cache_ttl = getattr(settings, 'SLACK_EVENT_CACHE_TTL', 600)
+        if event_cache == 'memory':
+            self.event_cache = MemoryEventCache(ttl=event_cache_ttl)
+        elif event_cache == 'db':
+            self.event_cache = DatabaseEventCache(ttl=event_cache_ttl)
+        elif event_cache is None:
+            self.event_cache = None
+        else:
+            raise SlackException(f'unrecognized event_cache={event_cache}')
+
         @app.event("message")
-        def _wrapper_message(event, *args, **kwargs):
-            self.message(event)
+        def _wrapper_message(event, body, request, *args, **kwargs):
+            self._enqueue(
+                'message',
+                event,
+                body,
+                request,
+                low_priority=self._low_priority(event),
+            )
 
         @app.event("member_joined_channel")
-        def _wrapper_member_joined(event, *args, **kwargs):
-            self.member_joined_channel(event)
+        def _wrapper_member_joined(event, body, request, *args, **kwargs):
+            self._enqueue('member_joined_channel', event, body, request)
 
         @app.event("member_left_channel")
-        def _wrapper_member_left(event, *args, **kwargs):
-            self.member_left_channel(event)
+        def _wrapper_member_left(event, body, request, *args, **kwargs):
+            self._enqueue('member_left_channel', event, body, request)
 
         @app.event("channel_rename")
-        def _wrapper_channel_rename(event, *args, **kwargs):
-            self.channel_rename(event)
+        def _wrapper_channel_rename(event, body, request, *args, **kwargs):
+            self._enqueue('channel_rename', event, body, request)
 
         # TODO: emit data from auth_info to dispatcher on startup?
 
+    def _process(self, kind, event):
+        if kind not in self._PROCESSORS:
+            raise SlackException(f'unrecognized event kind={kind}')
+        getattr(self, kind)(event)
+
+    def _retry_num(self, request):
+        try:
+            return int(request.headers.get('x-slack-retry-num', ['0'])[0])
+        except (AttributeError, IndexError, ValueError):
+            return 0
+
+    def _enqueue(self, kind, event, body, request, low_priority=False):
+        event_id = (body or {}).get('event_id', None)
+        if self.event_cache is None or event_id is None:
+            event_id = None
+        elif self.event_cache.duplicate(event_id, self._retry_num(request)):
+            self.log.info(
+                '_enqueue: skipping duplicate kind=%s, event_id=%s',
+                kind,
+                event_id,
+            )
+            return
+        if not self.events.put(kind, event, low_priority=low_priority):
+            if event_id is not None:
+                # it was dropped, let Slack's retry through when it comes
+                self.event_cache.forget(event_id)
+
+    def _low_priority(self, event):
+        # plain chatter, as opposed to commands, edits, and housekeeping, is
+        # the first thing we'll shed when we're backed up. This is a quick
+        # check, it doesn't need to be exact.
+        if event.get('subtype', None) is not None:
+            return False
+        text = event.get('text', '')
+        return not (
+            text.startswith(self.dispatcher.LEADER) or text.startswith('<@')
+        )
+
     def urlpatterns(self):
 
         handler = SlackRequestHandler(app=self.app)
@@ -115,10 +239,7 @@ class SlackListener(object):
         return [path("slack/events", slack_events_handler, name="slack_events")]
 
     def channel(self, channel_name):
-        try:
-            return Channel.objects.get(name=channel_name)
-        except Channel.DoesNotExist:
-            return None
+        return self.channels.get_by_name(channel_name)
 
     def context(self, channel=None, thread=None, timestamp=None):
         return SlackContext(
@@ -182,13 +303,66 @@ class SlackListener(object):
         return resp.data['channel']
 
     def _get_or_create_channel(self, channel_id):
-        try:
-            return Channel.objects.get(id=channel_id)
-        except Channel.DoesNotExist:
-            pass
+        channel = self.channels.get(channel_id)
+        if channel is not None:
+            return channel
         channel = self._channel_info(channel_id)
         params = self._channel_params(channel)
-        return Channel.objects.create(**params)
+        channel = Channel.objects.create(**params)
+        self.channels.put(channel)
+        return channel
+
+    def _upsert_channels(self, channels):
+        if not channels:
+            return
+        objs = [Channel(**self._channel_params(c)) for c in channels]
+        # MySQL upserts on any unique key and doesn't accept a target
+        unique_fields = None
+        if connection.features.supports_update_conflicts_with_target:
+            unique_fields = ('id',)
+        Channel.objects.bulk_create(
+            objs,
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=('name', 'channel_type', 'updated_at'),
+        )
+        for channel in objs:
+            self.channels.put(channel)
+
+    def sync_channels(self, batch_size=200):
+        '''
+        Pages through conversations.list upserting a batch of channels per
+        page. Returns the number of channels synced.
+        '''
+        self.log.info('sync_channels: batch_size=%d', batch_size)
+        n = 0
+        cursor = None
+        while True:
+            resp = self.app.client.conversations_list(
+                types='public_channel,private_channel,im',
+                exclude_archived=True,
+                limit=batch_size,
+                cursor=cursor,
+            )
+            channels = resp.data['channels']
+            self._upsert_channels(channels)
+            n += len(channels)
+            cursor = resp.data.get('response_metadata', {}).get(
+                'next_cursor', None
+            )
+            if not cursor:
+                break
+        self.log.info('sync_channels: synced=%d', n)
+        return n
+
+    def tick(self, now):
+        if self.sync_channels_on_start and not self._synced_channels:
+            self._synced_channels = True
+            self.sync_channels()
+        elif self.sync_channels_when and CronValidator.match_datetime(
+            self.sync_channels_when, now
+        ):
+            self.sync_channels()
 
     def channel_rename(self, event):
         self.log.debug('channel_rename: event=%s', event)
@@ -197,6 +371,8 @@ class SlackListener(object):
         channel, _ = Channel.objects.update_or_create(
             id=channel_id, defaults=params
         )
+        # replaces any cached entries for the channel, including the old name
+        self.channels.put(channel)
 
     def message(self, event):
         self.log.debug('message: event=%s', event)
@@ -254,9 +430,8 @@ class SlackListener(object):
                     channel_name,
                     user,
                 )
-                try:
-                    removed_from = Channel.objects.get(name=channel_name)
-                except Channel.DoesNotExist:
+                removed_from = self.channel(channel_name)
+                if removed_from is None:
                     self.log.warn(
                         'message: removed from channel (%s) we do not recognize',
                         channel_name,
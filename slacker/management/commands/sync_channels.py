@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from simone.urls import dispatcher
+
+
+class Command(BaseCommand):
+    name = 'sync_channels'
+    help = 'Sync all Slack channels using conversations.list'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        n = dispatcher.listeners['slack'].sync_channels(
+            batch_size=options['batch_size']
+        )
+        self.stdout.write(f'Synced {n} channels')
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [('slacker', '0003_auto_20211021_1536')]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeenEvent',
+            fields=[
+                (
+                    'event_id',
+                    models.CharField(
+                        max_length=64, primary_key=True, serialize=False
+                    ),
+                ),
+                (
+                    'created_at',
+                    models.DateTimeField(auto_now_add=True, db_index=True),
+                ),
+            ],
+        )
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [('slacker', '0004_seenevent')]
+
+    operations = [
+        migrations.AlterField(
+            model_name='channel',
+            name='name',
+            field=models.CharField(db_index=True, max_length=255),
+        )
+    ]
@@ -57,7 +57,7 @@ class Channel(models.Model):
         DIRECT = 'direct'
 
     id = models.CharField(max_length=16, primary_key=True)
-    name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, db_index=True)
     channel_type = models.CharField(max_length=7, choices=Type.choices)
 
     updated_at = models.DateTimeField(auto_now=True)
@@ -72,3 +72,17 @@ class Channel(models.Model):
         elif self.channel_type == 'private':
             return ChannelType.PRIVATE
         return ChannelType.DIRECT
+
+
+class SeenEvent(models.Model):
+    '''
+    Slack event ids that have recently been dispatched, shared between
+    workers so that redeliveries can be ignored.
+    '''
+
+    event_id = models.CharField(max_length=64, primary_key=True)
+
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return self.event_id
@@ -0,0 +1,194 @@
+from logging import getLogger
+from slack_sdk.errors import SlackApiError
+from threading import Lock
+from time import monotonic, sleep
+
+from simone.metrics import metrics
+
+metrics.describe(
+    'simone_slack_rate_limit_wait_seconds',
+    'histogram',
+    'Time outbound Slack calls waited for a rate limit token',
+)
+metrics.describe(
+    'simone_slack_rate_limited_total',
+    'counter',
+    'Outbound Slack calls that were answered with a 429',
+)
+
+
+class TokenBucket(object):
+    '''
+    Allows rate requests per second on average with bursts of up to burst.
+
+    Callers reserve a token with acquire and then wait the returned number of
+    seconds before proceeding. Tokens are allowed to go negative so that
+    waiting callers are queued up behind one another rather than racing.
+    '''
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+
+        self._tokens = burst
+        self._last = monotonic()
+        self._not_before = 0
+        self._lock = Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = monotonic()
+            # nothing goes before the end of a pause so that's where our
+            # accounting starts from
+            start = max(now, self._not_before)
+            self._tokens = min(
+                self.burst, self._tokens + (start - self._last) * self.rate
+            )
+            self._last = start
+            self._tokens -= 1
+            wait = start - now
+            if self._tokens < 0:
+                wait += -self._tokens / self.rate
+            return wait
+
+    def pause(self, seconds):
+        '''
+        Nothing will be allowed through for the next seconds, e.g. when we've
+        been told to Retry-After.
+        '''
+        with self._lock:
+            not_before = monotonic() + seconds
+            if not_before <= self._not_before:
+                return
+            self._not_before = not_before
+            # tokens don't accrue while we're paused and there's no burst at
+            # the end of it, one caller goes and the rest are spaced out
+            # behind it
+            self._tokens = min(self._tokens, 1)
+            self._last = not_before
+
+
+class RateLimiter(object):
+    '''
+    Token buckets for outbound Slack API calls keyed by method and, for the
+    methods Slack limits that way, channel.
+
+    https://api.slack.com/docs/rate-limits
+    '''
+
+    # method: (rate/s, burst, per-channel)
+    LIMITS = {
+        # special, ~1 per second per channel with short bursts allowed
+        'chat.postMessage': (1.0, 3, True),
+        # tier 4, 100+ per minute
+        'chat.postEphemeral': (100 / 60.0, 10, False),
+        # tier 3, 50+ per minute
+        'reactions.add': (50 / 60.0, 5, False),
+    }
+    # tier 3 for anything else
+    DEFAULT_LIMIT = (50 / 60.0, 5, False)
+
+    log = getLogger('RateLimiter')
+
+    def __init__(self, limits=None, max_retries=3):
+        self.limits = dict(self.LIMITS)
+        self.limits.update(limits or {})
+        self.max_retries = max_retries
+
+        self._buckets = {}
+        self._stats = {}
+        self._lock = Lock()
+
+    def _bucket(self, method, channel):
+        rate, burst, per_channel = self.limits.get(method, self.DEFAULT_LIMIT)
+        key = (method, channel if per_channel else None)
+        try:
+            return self._buckets[key]
+        except KeyError:
+            pass
+        with self._lock:
+            return self._buckets.setdefault(key, TokenBucket(rate, burst))
+
+    def _record(self, method, wait=0, limited=False):
+        labels = (('method', method),)
+        if limited:
+            metrics.inc('simone_slack_rate_limited_total', labels)
+        else:
+            metrics.observe(
+                'simone_slack_rate_limit_wait_seconds', wait, labels
+            )
+        with self._lock:
+            try:
+                stats = self._stats[method]
+            except KeyError:
+                stats = self._stats[method] = {
+                    'calls': 0,
+                    'waits': 0,
+                    'wait_seconds': 0.0,
+                    'max_wait': 0.0,
+                    'rate_limited': 0,
+                }
+            if limited:
+                stats['rate_limited'] += 1
+                return
+            stats['calls'] += 1
+            if wait > 0:
+                stats['waits'] += 1
+                stats['wait_seconds'] += wait
+                stats['max_wait'] = max(stats['max_wait'], wait)
+
+    def stats(self):
+        with self._lock:
+            return {m: dict(s) for m, s in self._stats.items()}
+
+    def _retry_after(self, response):
+        try:
+            headers = response.headers
+        except AttributeError:
+            return 1
+        for k, v in headers.items():
+            if k.lower() == 'retry-after':
+                if isinstance(v, (list, tuple)):
+                    v = v[0]
+                try:
+                    return float(v)
+                except ValueError:
+                    break
+        return 1
+
+    def call(self, method, channel, func, **kwargs):
+        '''
+        Calls func(**kwargs) once a token is available for method & channel,
+        waiting rather than erroring when we're over the limit or have been
+        told to Retry-After.
+        '''
+        bucket = self._bucket(method, channel)
+        attempt = 0
+        while True:
+            wait = bucket.acquire()
+            self._record(method, wait)
+            if wait > 0:
+                self.log.debug(
+                    'call: method=%s, channel=%s, wait=%f',
+                    method,
+                    channel,
+                    wait,
+                )
+                sleep(wait)
+            try:
+                return func(**kwargs)
+            except SlackApiError as e:
+                if getattr(e.response, 'status_code', None) != 429:
+                    raise
+                self._record(method, limited=True)
+                if attempt >= self.max_retries:
+                    raise
+                retry_after = self._retry_after(e.response)
+                self.log.warning(
+                    'call: rate limited, method=%s, channel=%s, retry_after=%f',
+                    method,
+                    channel,
+                    retry_after,
+                )
+                bucket.pause(retry_after)
+                attempt += 1
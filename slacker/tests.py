@@ -1,8 +1,13 @@
 from mock import MagicMock, patch
 from django.test import TestCase
+from slack_sdk.errors import SlackApiError
 
 from simone.context import ChannelType
-from .models import Channel
+from simone.metrics import metrics
+from .channels import ChannelCache
+from .events import DatabaseEventCache, EventQueue, MemoryEventCache
+from .models import Channel, SeenEvent
+from .ratelimit import RateLimiter, TokenBucket
 from .listeners import SenderType, SlackContext, SlackListener
 
 
@@ -1007,3 +1012,330 @@ class TestSlackListener(TestCase):
         # reload our object and see if the name changed
         channel.refresh_from_db()
         self.assertEqual('bot-dev-rename', channel.name)
+
+
+class TestEventQueue(TestCase):
+    def test_process(self):
+        processed = []
+
+        def process(kind, event):
+            processed.append((kind, event))
+            if event.get('fail'):
+                raise Exception('boom')
+
+        events = EventQueue(process, maxsize=10, consumers=2)
+        self.assertTrue(events.put('message', {'fail': True}))
+        self.assertTrue(events.put('channel_rename', {'id': 42}))
+        events.join()
+        # failures are logged and don't stop the consumers
+        self.assertEqual(
+            [('channel_rename', {'id': 42}), ('message', {'fail': True})],
+            sorted(processed, key=lambda p: p[0]),
+        )
+        self.assertEqual(0, events.depth)
+
+    def test_when_full(self):
+        with self.assertRaises(ValueError):
+            EventQueue(None, when_full='panic')
+
+        # no consumers so nothing will drain the queue
+        events = EventQueue(None, maxsize=1, consumers=0, when_full='drop')
+        self.assertTrue(events.put('message', {}))
+        self.assertFalse(events.put('message', {}))
+        self.assertFalse(events.put('member_joined_channel', {}))
+        self.assertEqual(2, events.dropped)
+        self.assertEqual(1, events.depth)
+
+        events = EventQueue(None, maxsize=1, consumers=0, when_full='shed')
+        self.assertTrue(events.put('message', {}, low_priority=True))
+        self.assertFalse(events.put('message', {}, low_priority=True))
+        self.assertEqual(1, events.dropped)
+
+    def test_low_priority(self):
+        dispatcher = MagicMock()
+        dispatcher.LEADER = '.'
+        listener = SlackListener(dispatcher=dispatcher, app=DummyApp())
+
+        self.assertTrue(listener._low_priority({'text': 'just chatting'}))
+        self.assertFalse(listener._low_priority({'text': '.help'}))
+        self.assertFalse(listener._low_priority({'text': '<@U01V6PW6XDE> hi'}))
+        self.assertFalse(
+            listener._low_priority(
+                {'text': 'edited', 'subtype': 'message_changed'}
+            )
+        )
+
+
+class TestEventCaches(TestCase):
+    def test_memory(self):
+        cache = MemoryEventCache(ttl=600, maxsize=2)
+        self.assertFalse(cache.duplicate('Ev01'))
+        self.assertTrue(cache.duplicate('Ev01', retry_num=1))
+        self.assertFalse(cache.duplicate('Ev02', retry_num=1))
+        self.assertEqual({'hits': 1, 'misses': 2, 'retries': 2}, cache.stats())
+
+        # Ev01 is pushed out once we're over size
+        self.assertFalse(cache.duplicate('Ev03'))
+        self.assertFalse(cache.duplicate('Ev01'))
+
+        cache.forget('Ev01')
+        self.assertFalse(cache.duplicate('Ev01'))
+
+        # and things expire
+        cache = MemoryEventCache(ttl=-1)
+        self.assertFalse(cache.duplicate('Ev01'))
+        self.assertFalse(cache.duplicate('Ev01'))
+
+    def test_database(self):
+        cache = DatabaseEventCache(ttl=600)
+        self.assertFalse(cache.duplicate('Ev01'))
+        self.assertTrue(cache.duplicate('Ev01'))
+        # other workers see the same table
+        self.assertTrue(DatabaseEventCache().duplicate('Ev01'))
+        self.assertEqual(1, SeenEvent.objects.count())
+        DatabaseEventCache().forget('Ev01')
+        self.assertFalse(cache.duplicate('Ev01'))
+
+        # expired rows are purged
+        cache = DatabaseEventCache(ttl=-1)
+        self.assertFalse(cache.duplicate('Ev02'))
+        self.assertEqual(
+            ['Ev02'], [e.event_id for e in SeenEvent.objects.all()]
+        )
+
+    def test_enqueue(self):
+        dispatcher = MagicMock()
+        dispatcher.LEADER = '.'
+        listener = SlackListener(dispatcher=dispatcher, app=DummyApp())
+        listener.events = MagicMock()
+
+        request = MagicMock()
+        request.headers = {}
+        event = {'text': 'hi'}
+        listener._enqueue('message', event, {'event_id': 'Ev01'}, request)
+        listener.events.put.assert_called_once_with(
+            'message', event, low_priority=False
+        )
+
+        # a redelivery is skipped
+        listener.events.reset_mock()
+        request.headers = {'x-slack-retry-num': ['1']}
+        listener._enqueue('message', event, {'event_id': 'Ev01'}, request)
+        listener.events.put.assert_not_called()
+        self.assertEqual(
+            {'hits': 1, 'misses': 1, 'retries': 1}, listener.event_cache.stats()
+        )
+
+        # without an event_id there's nothing to go on
+        listener._enqueue('message', event, {}, request)
+        listener.events.put.assert_called_once()
+
+        # if the queue drops an event its retry is let through
+        listener.events.reset_mock()
+        listener.events.put.return_value = False
+        listener._enqueue('message', event, {'event_id': 'Ev02'}, request)
+        listener.events.put.return_value = True
+        listener._enqueue('message', event, {'event_id': 'Ev02'}, request)
+        self.assertEqual(2, listener.events.put.call_count)
+        self.assertIn(
+            'simone_slack_event_cache_total{result="hit"}', metrics.render()
+        )
+
+    def test_queue_metrics(self):
+        dispatcher = MagicMock()
+        dispatcher.LEADER = '.'
+        listener = SlackListener(dispatcher=dispatcher, app=DummyApp())
+        listener.events.dropped = 3
+        content = metrics.render()
+        self.assertIn('simone_slack_event_queue_depth 0', content)
+        self.assertIn('simone_slack_events_dropped 3', content)
+
+
+class TestChannelCache(TestCase):
+    def test_cache(self):
+        Channel.objects.create(
+            id='C01GTHYEU4B', name='bot-dev', channel_type=Channel.Type.PUBLIC
+        )
+        cache = ChannelCache(ttl=300)
+
+        # warms on first use, after that it's all in memory
+        with self.assertNumQueries(1):
+            channel = cache.get('C01GTHYEU4B')
+            self.assertEqual('bot-dev', channel.name)
+            self.assertEqual(channel, cache.get_by_name('bot-dev'))
+
+        # misses fall through to the db
+        Channel.objects.create(
+            id='C01UTGR299A',
+            name='bot-dev-private',
+            channel_type=Channel.Type.PRIVATE,
+        )
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                'C01UTGR299A', cache.get_by_name('bot-dev-private').id
+            )
+        with self.assertNumQueries(0):
+            self.assertEqual('bot-dev-private', cache.get('C01UTGR299A').name)
+        self.assertIsNone(cache.get('C00000000'))
+
+    def test_ttl(self):
+        Channel.objects.create(
+            id='C01GTHYEU4B', name='bot-dev', channel_type=Channel.Type.PUBLIC
+        )
+        cache = ChannelCache(ttl=-1)
+        cache.warm()
+        # everything is immediately expired so we go back to the db
+        with self.assertNumQueries(1):
+            self.assertEqual('bot-dev', cache.get('C01GTHYEU4B').name)
+
+    def test_rename(self):
+        dispatcher = MagicMock()
+        listener = SlackListener(dispatcher=dispatcher, app=DummyApp())
+        Channel.objects.create(
+            id='C02JNLHRQ3W', name='bot-dev', channel_type=Channel.Type.PUBLIC
+        )
+        self.assertEqual('C02JNLHRQ3W', listener.channel('bot-dev').id)
+
+        listener.channel_rename(
+            {
+                'type': 'channel_rename',
+                'channel': {
+                    'id': 'C02JNLHRQ3W',
+                    'is_channel': True,
+                    'name': 'bot-dev-renamed',
+                },
+                'event_ts': '1634828547.000900',
+            }
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                'C02JNLHRQ3W', listener.channel('bot-dev-renamed').id
+            )
+            self.assertEqual(
+                'bot-dev-renamed',
+                listener._get_or_create_channel('C02JNLHRQ3W').name,
+            )
+        # the old name is gone
+        self.assertIsNone(listener.channel('bot-dev'))
+
+
+class TestSyncChannels(TestCase):
+    def test_sync_channels(self):
+        app = MagicMock()
+        first = MagicMock()
+        first.data = {
+            'channels': [
+                {'id': 'C01GTHYEU4B', 'name': 'bot-dev', 'is_channel': True},
+                {
+                    'id': 'C01UTGR299A',
+                    'name': 'bot-dev-private',
+                    'is_channel': True,
+                    'is_private': True,
+                },
+            ],
+            'response_metadata': {'next_cursor': 'abc'},
+        }
+        second = MagicMock()
+        second.data = {
+            'channels': [{'id': 'D01V6PW6XDE', 'user': 'U01GQ7UFKFX'}],
+            'response_metadata': {'next_cursor': ''},
+        }
+        app.client.conversations_list.side_effect = [first, second]
+
+        # an existing channel that's since been renamed
+        Channel.objects.create(
+            id='C01GTHYEU4B', name='old-name', channel_type=Channel.Type.PUBLIC
+        )
+        listener = SlackListener(dispatcher=MagicMock(), app=app)
+        self.assertEqual(3, listener.sync_channels(batch_size=2))
+        self.assertEqual(
+            [None, 'abc'],
+            [
+                c.kwargs['cursor']
+                for c in app.client.conversations_list.call_args_list
+            ],
+        )
+
+        self.assertEqual(
+            [
+                ('C01GTHYEU4B', 'bot-dev', 'public'),
+                ('C01UTGR299A', 'bot-dev-private', 'private'),
+                ('D01V6PW6XDE', 'U01GQ7UFKFX', 'direct'),
+            ],
+            list(
+                Channel.objects.order_by('id').values_list(
+                    'id', 'name', 'channel_type'
+                )
+            ),
+        )
+        self.assertEqual('C01GTHYEU4B', listener.channel('bot-dev').id)
+
+
+class TestRateLimiter(TestCase):
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=1.0, burst=2)
+        # burst goes straight through
+        self.assertEqual(0, bucket.acquire())
+        self.assertEqual(0, bucket.acquire())
+        # then we queue up behind one another
+        self.assertAlmostEqual(1, bucket.acquire(), places=1)
+        self.assertAlmostEqual(2, bucket.acquire(), places=1)
+        # and told to wait
+        bucket = TokenBucket(rate=1.0, burst=2)
+        bucket.pause(10)
+        self.assertAlmostEqual(10, bucket.acquire(), places=1)
+        # after which callers are spaced out at rate rather than all going
+        # at once
+        self.assertAlmostEqual(11, bucket.acquire(), places=1)
+        self.assertAlmostEqual(12, bucket.acquire(), places=1)
+
+    @patch('slacker.ratelimit.sleep')
+    def test_call(self, sleep_mock):
+        limiter = RateLimiter(
+            limits={'chat.postMessage': (1.0, 1, True)}, max_retries=1
+        )
+        func = MagicMock(return_value='ok')
+        self.assertEqual(
+            'ok', limiter.call('chat.postMessage', 'C1', func, text='hi')
+        )
+        func.assert_called_once_with(text='hi')
+        sleep_mock.assert_not_called()
+        # a different channel has its own bucket
+        limiter.call('chat.postMessage', 'C2', func, text='hi')
+        sleep_mock.assert_not_called()
+        # the same one has to wait
+        limiter.call('chat.postMessage', 'C1', func, text='hi')
+        sleep_mock.assert_called_once()
+
+        # 429s are retried after Retry-After
+        sleep_mock.reset_mock()
+        response = MagicMock()
+        response.status_code = 429
+        response.headers = {'retry-after': ['30']}
+        limited = SlackApiError('ratelimited', response)
+        func = MagicMock(side_effect=[limited, 'ok'])
+        self.assertEqual('ok', limiter.call('reactions.add', 'C1', func))
+        self.assertEqual(2, func.call_count)
+        self.assertAlmostEqual(30, sleep_mock.call_args[0][0], places=1)
+
+        # until we run out of retries
+        func = MagicMock(side_effect=[limited, limited])
+        with self.assertRaises(SlackApiError):
+            limiter.call('reactions.add', 'C1', func)
+
+        # other errors aren't retried
+        response = MagicMock()
+        response.status_code = 200
+        func = MagicMock(side_effect=SlackApiError('nope', response))
+        with self.assertRaises(SlackApiError):
+            limiter.call('reactions.add', 'C1', func)
+        func.assert_called_once()
+
+        stats = limiter.stats()
+        self.assertIn(
+            'simone_slack_rate_limited_total{method="reactions.add"}',
+            metrics.render(),
+        )
+        self.assertEqual(3, stats['chat.postMessage']['calls'])
+        self.assertEqual(1, stats['chat.postMessage']['waits'])
+        self.assertEqual(3, stats['reactions.add']['rate_limited'])